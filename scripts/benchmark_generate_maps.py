@@ -0,0 +1,478 @@
+"""Benchmarks of the data processing steps of generate_maps.py.
+
+The inputs are synthetic so that no request is sent to the APIs,
+the reference implementations are the ones generate_maps.py used to rely on.
+"""
+
+import argparse
+import json
+import math
+import random
+import tempfile
+import tracemalloc
+from collections.abc import Callable
+from dataclasses import fields
+from datetime import date, timedelta
+from pathlib import Path
+from statistics import mean
+from time import perf_counter
+from typing import Any
+from xml.etree import ElementTree
+
+import numpy as np
+from generate_maps import (
+    AIR_QUALITY_HOURLY_VARIABLES,
+    DEPARTMENTS,
+    INSEE_CODE_COLUMN,
+    SVG_NAMESPACE,
+    WEATHER_DAILY_VARIABLES,
+    WEATHER_FIELDS,
+    AirQuality,
+    Weather,
+    build_plot,
+    compute_air_quality_batch,
+    compute_average_season_weather,
+    compute_average_season_weather_batch,
+    count_soil_pollution_incidents,
+    decode_json,
+    optimize_map,
+    parse_air_quality,
+    parse_svg_path,
+    parse_weather,
+)
+from openpyxl import Workbook, load_workbook
+
+
+def measure(func: Callable[[], Any]) -> tuple[Any, float, int]:
+    """Return the result, the duration in seconds and the peak memory in bytes."""
+    start = perf_counter()
+    func()
+    duration = perf_counter() - start
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, duration, peak
+
+
+def print_comparison(
+    name: str,
+    reference: tuple[float, int],
+    candidate: tuple[float, int],
+) -> None:
+    reference_duration, reference_peak = reference
+    candidate_duration, candidate_peak = candidate
+    print(
+        f"{name}:\n"
+        f"  reference: {reference_duration:8.3f} s {reference_peak / 2**20:10.1f} MiB\n"
+        f"  candidate: {candidate_duration:8.3f} s {candidate_peak / 2**20:10.1f} MiB\n"
+        f"  speedup: x{reference_duration / candidate_duration:.1f}, "
+        f"memory: x{reference_peak / candidate_peak:.1f}",
+    )
+
+
+def synthetic_weather_response(
+    start_date: date,
+    end_date: date,
+    rng: random.Random,
+) -> dict[str, Any]:
+    days_count = (end_date - start_date).days + 1
+    daily: dict[str, list[Any]] = {
+        "time": [str(start_date + timedelta(days=i)) for i in range(days_count)],
+    }
+    for variable in WEATHER_DAILY_VARIABLES:
+        daily[variable] = [
+            # There is a hole in the data from time to time.
+            None if rng.random() < 0.0001 else round(rng.uniform(0, 40), 1)
+            for _ in range(days_count)
+        ]
+
+    return {"daily": daily}
+
+
+def legacy_parse_weather(json_content: dict[str, Any]) -> dict[date, Weather]:
+    json_content = json_content["daily"]
+    columns = [json_content[variable] for variable in WEATHER_DAILY_VARIABLES]
+
+    measurements: dict[date, Weather] = {}
+    for i, day in enumerate(json_content["time"]):
+        row = [column[i] for column in columns]
+        if any(v is None for v in row):
+            continue
+
+        year, month, day_of_month = (int(token) for token in day.split("-"))
+        row[WEATHER_FIELDS.index("daylight_duration")] /= 3600
+        row[WEATHER_FIELDS.index("sunshine_duration")] /= 3600
+        row[WEATHER_FIELDS.index("snowfall_sum")] *= 10
+        measurements[date(year, month, day_of_month)] = Weather(*row)
+
+    return measurements
+
+
+def legacy_compute_average_season_weather(
+    weather_measurements: dict[date, Weather],
+) -> tuple[Weather, Weather]:
+    sum_fields = ("rainfall_sum", "snowfall_sum", "et0_fao_evapotranspiration")
+
+    def compute_season_weather(season_months: tuple[int, ...]) -> Weather:
+        values: dict[str, list[float]] = {field: [] for field in WEATHER_FIELDS}
+        for year in {day.year for day in weather_measurements}:
+            for_the_given_year = {
+                day: wm for day, wm in weather_measurements.items() if day.year == year
+            }
+            season_measurements = [
+                wm
+                for month in season_months
+                for day, wm in for_the_given_year.items()
+                if day.month == month
+            ]
+            for field in WEATHER_FIELDS:
+                if field in sum_fields:
+                    values[field].append(
+                        sum(getattr(wm, field) for wm in season_measurements),
+                    )
+                else:
+                    values[field] += [getattr(wm, field) for wm in season_measurements]
+
+        return Weather(*(mean(values[field]) for field in WEATHER_FIELDS))
+
+    return compute_season_weather((12, 1, 2)), compute_season_weather((6, 7, 8))
+
+
+def assert_same_weather(reference: Weather, candidate: Weather) -> None:
+    for field in WEATHER_FIELDS:
+        expected, actual = getattr(reference, field), getattr(candidate, field)
+        if abs(expected - actual) > 1e-9 * max(1, abs(expected)):
+            error = f"{field}: expected {expected}, got {actual}"
+            raise AssertionError(error)
+
+
+def benchmark_weather(args: argparse.Namespace) -> None:
+    cities_count = args.cities
+    rng = random.Random(0)
+    responses = [
+        json.dumps(
+            synthetic_weather_response(date(1994, 1, 1), date(2023, 12, 31), rng),
+        ).encode()
+        for _ in range(cities_count)
+    ]
+
+    legacy_measurements, *legacy_decoding = measure(
+        lambda: [legacy_parse_weather(json.loads(response)) for response in responses],
+    )
+    measurements, *decoding = measure(
+        lambda: [parse_weather(decode_json(response)) for response in responses],
+    )
+    print_comparison(
+        f"Decoding the daily weather of {cities_count} cities",
+        legacy_decoding,
+        decoding,
+    )
+
+    legacy_means, *legacy_aggregation = measure(
+        lambda: [legacy_compute_average_season_weather(m) for m in legacy_measurements],
+    )
+    means, *aggregation = measure(
+        lambda: [compute_average_season_weather(m) for m in measurements],
+    )
+    print_comparison(
+        f"Computing the season means of {cities_count} cities",
+        legacy_aggregation,
+        aggregation,
+    )
+
+    batch_means, *batch_aggregation = measure(
+        lambda: compute_average_season_weather_batch(measurements),
+    )
+    print_comparison(
+        f"Computing the season means of {cities_count} cities in a single pass",
+        legacy_aggregation,
+        batch_aggregation,
+    )
+
+    for candidate_means in (means, batch_means):
+        for legacy_city_means, city_means in zip(
+            legacy_means,
+            candidate_means,
+            strict=True,
+        ):
+            for legacy_season_mean, season_mean in zip(
+                legacy_city_means,
+                city_means,
+                strict=True,
+            ):
+                assert_same_weather(legacy_season_mean, season_mean)
+
+
+def synthetic_air_quality_response(hours_count: int, rng: random.Random) -> dict:
+    return {
+        "hourly": {
+            variable: [
+                # Some hours are missing, the first ones of the history in particular.
+                None if i < 24 or rng.random() < 0.001 else rng.randint(0, 150)
+                for i in range(hours_count)
+            ]
+            for variable in AIR_QUALITY_HOURLY_VARIABLES
+        },
+    }
+
+
+def legacy_compute_air_quality(json_content: dict[str, Any]) -> list[float]:
+    """Return the minimums, maximums and means of the indices."""
+    json_content = json_content["hourly"]
+    columns = [
+        [v for v in json_content[variable] if v is not None]
+        for variable in AIR_QUALITY_HOURLY_VARIABLES
+    ]
+    return (
+        [min(column) for column in columns]
+        + [max(column) for column in columns]
+        + [mean(column) for column in columns]
+    )
+
+
+def benchmark_air_quality(args: argparse.Namespace) -> None:
+    rng = random.Random(0)
+    # Two years of hourly values.
+    responses = [
+        synthetic_air_quality_response(2 * 365 * 24, rng) for _ in range(args.cities)
+    ]
+
+    legacy_results, *legacy_reduction = measure(
+        lambda: [legacy_compute_air_quality(response) for response in responses],
+    )
+    air_qualities, *reduction = measure(
+        lambda: compute_air_quality_batch(
+            np.stack([parse_air_quality(response) for response in responses]),
+        ),
+    )
+    print_comparison(
+        f"Reducing the hourly air quality of {args.cities} cities",
+        legacy_reduction,
+        reduction,
+    )
+
+    # The legacy path doesn't compute the percentiles.
+    compared_fields = [
+        field.name
+        for field in fields(AirQuality)
+        if field.name.endswith(("_min", "_max", "_mean"))
+    ]
+    for legacy_result, air_quality in zip(legacy_results, air_qualities, strict=True):
+        for field, expected in zip(compared_fields, legacy_result, strict=True):
+            actual = getattr(air_quality, field)
+            if abs(expected - actual) > 1e-9 * max(1, abs(expected)):
+                error = f"{field}: expected {expected}, got {actual}"
+                raise AssertionError(error)
+
+
+def synthetic_basol_export(path: Path, rows_count: int, rng: random.Random) -> None:
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.append([f"Colonne {i}" for i in range(1, 21)])
+    for i in range(rows_count):
+        department_code = rng.choice(list(DEPARTMENTS))
+        row: list[Any] = [f"Site {i}", f"SSP{i:06d}", rng.uniform(0, 1000)]
+        row += [f"Description {rng.random()}" for _ in range(len(row), 20)]
+        row[INSEE_CODE_COLUMN - 1] = f"{department_code}{rng.randint(1, 99):03d}"[-5:]
+        worksheet.append(row)
+
+    workbook.save(path)
+
+
+def legacy_count_soil_pollution_incidents(xlsx_file: Path) -> dict[str, int]:
+    incidents_count_per_department = {code: 0 for code in DEPARTMENTS}
+    worksheet = load_workbook(xlsx_file).active
+
+    for row in worksheet.iter_rows(min_row=2):
+        insee_code = row[INSEE_CODE_COLUMN - 1].value
+        department_code = (
+            insee_code[:3] if insee_code.startswith("97") else insee_code[:2]
+        )
+        incidents_count_per_department[department_code] = (
+            incidents_count_per_department.get(department_code, 0) + 1
+        )
+
+    return incidents_count_per_department
+
+
+def benchmark_basol(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        xlsx_file = Path(directory, "basol.xlsx")
+        synthetic_basol_export(xlsx_file, args.rows, random.Random(0))
+
+        legacy_counts, *legacy_parsing = measure(
+            lambda: legacy_count_soil_pollution_incidents(xlsx_file),
+        )
+        counts, *parsing = measure(lambda: count_soil_pollution_incidents(xlsx_file))
+
+    print_comparison(
+        f"Counting the soil pollution incidents of a {args.rows} rows BASOL export",
+        legacy_parsing,
+        parsing,
+    )
+
+    if counts != legacy_counts:
+        error = "Soil pollution incidents counts differ"
+        raise AssertionError(error)
+
+
+def department_paths(svg: bytes) -> tuple[list[str], float]:
+    """Return the department paths of a map and the size of a pixel in path units."""
+    root = ElementTree.fromstring(svg)
+    departments_svg = next(
+        element
+        for element in root.iter(f"{{{SVG_NAMESPACE}}}svg")
+        if element is not root
+    )
+    pixel_size = float(departments_svg.get("viewBox", "").split()[2]) / float(
+        departments_svg.get("width", ""),
+    )
+    paths = [
+        path.get("d", "") for path in departments_svg.iter(f"{{{SVG_NAMESPACE}}}path")
+    ]
+
+    return paths, pixel_size
+
+
+def rasterize(rings: list[np.ndarray], pixel_size: float) -> dict[int, np.ndarray]:
+    """Return the pixels inside the rings, per row, with the even-odd fill rule.
+
+    A pixel is inside if its center is, like a renderer without anti-aliasing would.
+    """
+    starts = np.vstack(rings)
+    ends = np.vstack([np.roll(ring, -1, axis=0) for ring in rings])
+    columns_count = math.ceil(max(starts[:, 0].max(), 0) / pixel_size) + 1
+    pixel_centers = (np.arange(columns_count) + 0.5) * pixel_size
+
+    rows = {}
+    first_row = math.floor(starts[:, 1].min() / pixel_size)
+    last_row = math.ceil(starts[:, 1].max() / pixel_size)
+    for row in range(first_row, last_row + 1):
+        y = (row + 0.5) * pixel_size
+        crossing = (starts[:, 1] > y) != (ends[:, 1] > y)
+        if not crossing.any():
+            continue
+
+        crossing_starts, crossing_ends = starts[crossing], ends[crossing]
+        crossings = np.sort(
+            crossing_starts[:, 0]
+            + (y - crossing_starts[:, 1])
+            * (crossing_ends[:, 0] - crossing_starts[:, 0])
+            / (crossing_ends[:, 1] - crossing_starts[:, 1]),
+        )
+        rows[row] = np.searchsorted(crossings, pixel_centers) % 2 == 1
+
+    return rows
+
+
+def count_different_pixels(
+    reference: dict[int, np.ndarray],
+    candidate: dict[int, np.ndarray],
+) -> tuple[int, int]:
+    """Return how many pixels differ and how many pixels the reference fills."""
+    different_pixels = 0
+    for row in reference.keys() | candidate.keys():
+        reference_row = reference.get(row, np.zeros(0, dtype=bool))
+        candidate_row = candidate.get(row, np.zeros(0, dtype=bool))
+        width = max(len(reference_row), len(candidate_row))
+        reference_row = np.pad(reference_row, (0, width - len(reference_row)))
+        candidate_row = np.pad(candidate_row, (0, width - len(candidate_row)))
+        different_pixels += int(np.count_nonzero(reference_row != candidate_row))
+
+    filled_pixels = sum(int(np.count_nonzero(row)) for row in reference.values())
+    return different_pixels, filled_pixels
+
+
+def benchmark_geometry(args: argparse.Namespace) -> None:
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        map_file = Path(directory, "carte.svg")
+        build_plot(
+            map_file,
+            "Carte",
+            {code: rng.uniform(0, 100) for code in DEPARTMENTS},
+            [("Faible", "#BBDEFB"), ("Moyenne", "#42A5F5"), ("Forte", "#1565C0")],
+            shared_geometry=False,
+            simplification_tolerance=0,
+        )
+        svg = map_file.read_bytes()
+
+    paths, pixel_size = department_paths(svg)
+    # Curves are finely approximated so that the reference is close to what
+    # a browser draws.
+    reference_rasters = [
+        rasterize(parse_svg_path(d, pixel_size / 100), pixel_size) for d in paths
+    ]
+
+    print(f"Simplifying a {len(svg) / 1024:.0f} KiB map:")
+    for tolerance in args.tolerances:
+        optimized_svg, duration, _ = measure(lambda: optimize_map(svg, tolerance))  # noqa: B023
+        optimized_paths, _ = department_paths(optimized_svg)
+
+        different_pixels = filled_pixels = 0
+        for reference_raster, d in zip(reference_rasters, optimized_paths, strict=True):
+            different, filled = count_different_pixels(
+                reference_raster,
+                rasterize(parse_svg_path(d, pixel_size / 100), pixel_size),
+            )
+            different_pixels += different
+            filled_pixels += filled
+
+        print(
+            f"  tolerance {tolerance:4} px: {len(optimized_svg) / 1024:6.0f} KiB "
+            f"in {duration:.3f} s, {different_pixels} pixels out of "
+            f"{filled_pixels} differ ({different_pixels / filled_pixels:.2%})",
+        )
+
+
+BENCHMARKS = {
+    "weather": benchmark_weather,
+    "air_quality": benchmark_air_quality,
+    "basol": benchmark_basol,
+    "geometry": benchmark_geometry,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        metavar="benchmark",
+        help=f"which benchmarks to run among {', '.join(BENCHMARKS)} (default: all)",
+    )
+    parser.add_argument(
+        "--cities",
+        type=int,
+        default=100,
+        help="how many cities are processed by the weather and air quality benchmarks",
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=20_000,
+        help="how many rows the BASOL export of the basol benchmark has",
+    )
+    parser.add_argument(
+        "--tolerances",
+        type=float,
+        nargs="+",
+        default=[0.25, 0.5, 1, 2],
+        metavar="PIXELS",
+        help="which simplification tolerances the geometry benchmark compares",
+    )
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark '{name}'")
+
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,97 @@
+import argparse
 import csv
+import hashlib
+import json
+import math
 import os
+import random
 import re
+import sqlite3
+import threading
+import unicodedata
 import warnings
-from dataclasses import dataclass
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, fields
 from datetime import date
-from io import BytesIO, TextIOWrapper
+from io import TextIOWrapper
+from operator import attrgetter
 from pathlib import Path
-from statistics import mean
-from tempfile import NamedTemporaryFile, TemporaryFile
-from time import sleep
-from typing import Any
+from tempfile import NamedTemporaryFile
+from time import monotonic, perf_counter, sleep
+from typing import Any, BinaryIO, TypeVar
 from urllib.parse import urlsplit, urlunsplit
+from uuid import NAMESPACE_URL, uuid5
+from xml.etree import ElementTree
 from zipfile import ZipFile
 
+import numpy as np
 import requests
 import requests_cache
-from jenkspy import jenks_breaks
 from openpyxl import load_workbook
 from pygal.config import Config
 from pygal.style import Style
 from pygal_maps_fr.maps import DEPARTMENTS
 from pygal_maps_fr.maps import Departments as FrenchMapDepartments
 
+try:
+    import orjson
+except ImportError:  # orjson only makes decoding faster
+    orjson = None
+
 THIS_SCRIPT_LOCATION = Path(os.path.realpath(__file__)).parent
 HTTP_TIMEOUT = 10
 
-requests_cache.install_cache("generate_maps")
+# How many requests can be sent to Open-Meteo at the same time.
+METEO_MAX_CONCURRENT_REQUESTS = int(
+    os.environ.get("METEO_MAX_CONCURRENT_REQUESTS", "8")
+)
+
+# How many cities are sent to Open-Meteo in a single multi-location request.
+METEO_BATCH_SIZE = int(os.environ.get("METEO_BATCH_SIZE", "10"))
+
+# Name of the SQLite cache of the HTTP responses.
+HTTP_CACHE_NAME = "generate_maps"
+
+requests_cache.install_cache(HTTP_CACHE_NAME)
+
+# Where the per-city aggregates are kept between runs.
+RESULT_STORE_PATH = Path("generate_maps_results.sqlite")
+
+# Where the GASPAR and BASOL databases are downloaded.
+DOWNLOADS_DIRECTORY = Path("downloads")
+
+# Where the GeoNames dumps used for offline geocoding are downloaded.
+GAZETTEER_DIRECTORY = Path("gazetteer")
+
+# The overseas departments have their own country code in GeoNames.
+GAZETTEER_COUNTRY_CODES = {
+    "FR": None,  # the department code is given by admin2
+    "GP": "971",
+    "MQ": "972",
+    "GF": "973",
+    "RE": "974",
+    "PM": "975",
+    "YT": "976",
+}
+
+# How long to wait for another process writing to the same SQLite database.
+SQLITE_TIMEOUT = 60
+
+# To be increased whenever the way aggregates are computed changes,
+# so that the ones computed by a previous version are considered stale.
+RESULT_STORE_VERSION = 1
+
+# To be increased whenever the result of a parser of BulkDownloads changes,
+# so that the results parsed by a previous version are parsed again.
+PARSED_DOWNLOADS_VERSION = 1
+
+# Where the maps are rendered.
+MAPS_DIRECTORY = THIS_SCRIPT_LOCATION.joinpath("../_static/images")
+
+# To be increased whenever the way maps are rendered changes,
+# so that the ones rendered by a previous version are rendered again.
+MAP_RENDERER_VERSION = 1
 
 
 class CityError(Exception):
@@ -48,6 +114,10 @@ class SoilPollutionError(Exception):
     """Raised when something went wrong with the processing of the BASOL database."""
 
 
+class MapError(Exception):
+    """Raised when something went wrong with the rendering of a map."""
+
+
 @dataclass(frozen=True)
 class City:
     name: str
@@ -81,6 +151,20 @@ class AirQuality:
     european_aqi_ozone_mean: float
     european_aqi_sulphur_dioxide_mean: float
 
+    european_aqi_p95: float
+    european_aqi_pm2_5_p95: float
+    european_aqi_pm10_p95: float
+    european_aqi_nitrogen_dioxide_p95: float
+    european_aqi_ozone_p95: float
+    european_aqi_sulphur_dioxide_p95: float
+
+    european_aqi_p99: float
+    european_aqi_pm2_5_p99: float
+    european_aqi_pm10_p99: float
+    european_aqi_nitrogen_dioxide_p99: float
+    european_aqi_ozone_p99: float
+    european_aqi_sulphur_dioxide_p99: float
+
 
 @dataclass(frozen=True)
 class Weather:
@@ -131,7 +215,210 @@ class Weather:
     et0_fao_evapotranspiration: float
 
 
-def requests_get_meteo(url: str, params: dict) -> dict[str, Any]:
+WEATHER_FIELDS = [field.name for field in fields(Weather)]
+
+# Daily variables of the archive API, in the same order as the Weather fields.
+WEATHER_DAILY_VARIABLES = [
+    "temperature_2m_max",
+    "temperature_2m_min",
+    "temperature_2m_mean",
+    "apparent_temperature_max",
+    "apparent_temperature_min",
+    "apparent_temperature_mean",
+    "wind_speed_10m_max",
+    "daylight_duration",
+    "sunshine_duration",
+    "shortwave_radiation_sum",
+    "rain_sum",
+    "snowfall_sum",
+    "precipitation_hours",
+    "et0_fao_evapotranspiration",
+]
+
+# Fields which are summed over a season instead of being averaged per day.
+WEATHER_SEASON_SUM_FIELDS = (
+    "rainfall_sum",
+    "snowfall_sum",
+    "et0_fao_evapotranspiration",
+)
+
+# Winter is considered to last over december, january and february.
+# Summer is considered to last over june, july and august.
+WINTER, SUMMER = 0, 1
+SEASONS_COUNT = 2
+IGNORED_SEASON = -1
+SEASON_OF_MONTH = np.array(
+    [
+        IGNORED_SEASON,  # there is no month 0
+        WINTER,  # january
+        WINTER,  # february
+        IGNORED_SEASON,
+        IGNORED_SEASON,
+        IGNORED_SEASON,
+        SUMMER,  # june
+        SUMMER,  # july
+        SUMMER,  # august
+        IGNORED_SEASON,
+        IGNORED_SEASON,
+        IGNORED_SEASON,
+        WINTER,  # december
+    ],
+)
+
+
+@dataclass(frozen=True)
+class WeatherSeries:
+    """Daily weather measurements of a city, stored column by column.
+
+    Columns of values are in the same order as the Weather fields,
+    a missing measurement is NaN.
+    """
+
+    time: np.ndarray  # datetime64[D], shape (days,)
+    values: np.ndarray  # float64, shape (days, len(WEATHER_FIELDS))
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.values[:, WEATHER_FIELDS.index(field)]
+
+
+@dataclass(frozen=True)
+class Quota:
+    calls: float
+    period: float  # in seconds
+
+
+# https://open-meteo.com/en/pricing
+METEO_FREE_QUOTAS = (
+    Quota(calls=600, period=60),
+    Quota(calls=5_000, period=3600),
+    Quota(calls=10_000, period=3600 * 24),
+)
+
+# The standard plan of the customer API allows 1 million calls per month,
+# shorter limits are not documented so we rely on the retry mechanism for them.
+METEO_CUSTOMER_QUOTAS = (Quota(calls=1_000_000, period=3600 * 24 * 30),)
+
+# Which quota period has been exceeded, given the reason returned by the API.
+METEO_LIMIT_EXCEEDED_REASONS = {
+    "Minutely API request limit exceeded": 60,
+    "Hourly API request limit exceeded": 3600,
+    "Daily API request limit exceeded": 3600 * 24,
+}
+
+METEO_RETRY_BASE_DELAY = 1  # in seconds
+
+
+class TokenBucket:
+    """Hold up to quota.calls tokens, refilled continuously over quota.period."""
+
+    def __init__(self, quota: Quota) -> None:
+        self.quota = quota
+        self.tokens = quota.calls
+        self.last_refill = monotonic()
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self.last_refill
+        self.tokens = min(
+            self.quota.calls,
+            self.tokens + elapsed * self.quota.calls / self.quota.period,
+        )
+        self.last_refill = now
+
+    def delay(self, weight: float) -> float:
+        """Return how many seconds to wait before weight tokens can be consumed.
+
+        A request weighting more than the whole bucket is let through once the
+        bucket is full, the tokens then go negative to delay the next requests.
+        """
+        missing = min(weight, self.quota.calls) - self.tokens
+        return max(0, missing * self.quota.period / self.quota.calls)
+
+
+class RateLimiter:
+    """Pace requests so that none of the given quotas is ever exceeded.
+
+    It is shared by all the threads sending requests to the same API.
+    """
+
+    def __init__(self, quotas: Iterable[Quota]) -> None:
+        self.buckets = [TokenBucket(quota) for quota in quotas]
+        self.lock = threading.Lock()
+
+    def acquire(self, weight: float = 1) -> None:
+        while True:
+            with self.lock:
+                now = monotonic()
+                for bucket in self.buckets:
+                    bucket.refill(now)
+
+                delay = max((b.delay(weight) for b in self.buckets), default=0)
+                if delay == 0:
+                    for bucket in self.buckets:
+                        bucket.tokens -= weight
+                    return
+
+            sleep(delay)
+
+    def split(self, parts: int) -> None:
+        """Keep only a share of the quotas, when they're shared between processes."""
+        with self.lock:
+            self.buckets = [
+                TokenBucket(Quota(bucket.quota.calls / parts, bucket.quota.period))
+                for bucket in self.buckets
+            ]
+
+    def exhaust(self, period: float) -> None:
+        """Empty the buckets of the given period, after the API told us it's over."""
+        with self.lock:
+            for bucket in self.buckets:
+                if bucket.quota.period == period:
+                    bucket.tokens = min(bucket.tokens, 0)
+
+
+METEO_RATE_LIMITER = RateLimiter(
+    METEO_CUSTOMER_QUOTAS if "METEO_API_KEY" in os.environ else METEO_FREE_QUOTAS,
+)
+
+
+def meteo_api_call_weight(params: dict) -> float:
+    """Return how many API calls a request is accounted for by Open-Meteo.
+
+    A request with more than 10 variables or more than 2 weeks of data counts
+    as several calls, and so does every location of a multi-location request.
+    """
+    locations_count = len(str(params.get("latitude", "")).split(","))
+
+    variables_count = sum(
+        len(variable.split(","))
+        for key in ("hourly", "daily")
+        for variable in params.get(key, [])
+    )
+
+    days_count = 1
+    if "start_date" in params and "end_date" in params:
+        start_date = date.fromisoformat(params["start_date"])
+        end_date = date.fromisoformat(params["end_date"])
+        days_count = (end_date - start_date).days + 1
+
+    return locations_count * max(1, variables_count / 10) * max(1, days_count / 14)
+
+
+def decode_json(content: bytes) -> Any:
+    """Decode a JSON document, with orjson if it's installed."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def requests_get_meteo(url: str, params: dict) -> Any:
+    return decode_json(requests_get_meteo_content(url, params))
+
+
+def requests_get_meteo_content(url: str, params: dict) -> bytes:
+    """Return the undecoded body of a successful response.
+
+    Decoding big responses can then be left to another process.
+    """
     # Free trial is available to get an API key with more requests per day.
     if "METEO_API_KEY" in os.environ:
         params["apikey"] = os.environ["METEO_API_KEY"]
@@ -140,36 +427,425 @@ def requests_get_meteo(url: str, params: dict) -> dict[str, Any]:
         tokens[1] = "customer-" + tokens[1]
         url = urlunsplit(tokens)
 
-    resp = requests.get(url, params=params, timeout=HTTP_TIMEOUT)
-    json_content = resp.json()
+    # Responses served from the cache don't count against the quotas.
+    resp = requests.get(url, params=params, timeout=HTTP_TIMEOUT, only_if_cached=True)
+    if resp.status_code == 200:
+        return resp.content
+
+    attempt = 0
+    while True:
+        METEO_RATE_LIMITER.acquire(meteo_api_call_weight(params))
+        resp = requests.get(url, params=params, timeout=HTTP_TIMEOUT)
+        if resp.status_code == 200:
+            return resp.content
+
+        json_content = decode_json(resp.content)
+
+        exceeded_period = next(
+            (
+                period
+                for reason, period in METEO_LIMIT_EXCEEDED_REASONS.items()
+                if reason in json_content["reason"]
+            ),
+            None,
+        )
 
-    if resp.status_code != 200:
-        if "Minutely API request limit exceeded" in json_content["reason"]:
-            print("Minutely API request limit reached, waiting for 60 seconds...")
-            sleep(60)
-            return requests_get_meteo(url, params)
+        if exceeded_period is None:
+            resp.raise_for_status()
+            return resp.content
 
-        if "Hourly API request limit exceeded" in json_content["reason"]:
-            print("Hourly API request limit reached, waiting for 1 hour...")
-            sleep(3600)
-            return requests_get_meteo(url, params)
+        METEO_RATE_LIMITER.exhaust(exceeded_period)
 
-        if "Daily API request limit exceeded" in json_content["reason"]:
-            print("Daily API request limit reached, waiting for 1 day...")
-            sleep(3600 * 24)
-            return requests_get_meteo(url, params)
+        # Exponential backoff with jitter, so that the threads which all got
+        # rejected at the same time don't retry all at once.
+        backoff = min(exceeded_period, METEO_RETRY_BASE_DELAY * 2**attempt)
+        backoff = backoff / 2 + random.uniform(0, backoff / 2)
+        print(
+            f"{json_content['reason']}, retrying in {backoff:.1f} seconds...",
+        )
+        sleep(backoff)
+        attempt += 1
 
-        resp.raise_for_status()
 
-    return resp.json()
+T = TypeVar("T")
 
 
-def get_weather(city: City, start_date: date, end_date: date) -> dict[date, Weather]:
-    json_content = requests_get_meteo(
+def batched(cities: Iterable[City], batch_size: int) -> list[list[City]]:
+    cities = list(cities)
+    return [cities[i : i + batch_size] for i in range(0, len(cities), batch_size)]
+
+
+def fetch_per_city(
+    fetch_batch: Callable[[list[City]], dict[City, T]],
+    cities: Iterable[City],
+    batch_size: int = METEO_BATCH_SIZE,
+    max_workers: int = METEO_MAX_CONCURRENT_REQUESTS,
+) -> dict[City, T]:
+    """Call fetch_batch for every batch of cities using a bounded pool of threads.
+
+    The results are returned in the same order as the input cities.
+    If one of the calls raises, the pending ones are cancelled and the
+    exception is propagated to the caller.
+    """
+    results: dict[City, T] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(fetch_batch, batch) for batch in batched(cities, batch_size)
+        ]
+        try:
+            for future in futures:
+                results.update(future.result())
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    return results
+
+
+class ResultStore:
+    """Persist the per-city aggregates so that they are computed only once.
+
+    Results are keyed by the coordinates of the city and by a dataset string
+    describing what has been computed (date range, variables, version...).
+    """
+
+    def __init__(self, path: Path) -> None:
+        # Results are saved from the threads fetching them.
+        self.connection = sqlite3.connect(
+            path,
+            timeout=SQLITE_TIMEOUT,
+            check_same_thread=False,
+        )
+        self.lock = threading.Lock()
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    dataset TEXT NOT NULL,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (dataset, latitude, longitude)
+                )
+                """,
+            )
+
+    def get(self, dataset: str, cities: Iterable[City]) -> dict[City, Any]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT latitude, longitude, value FROM results WHERE dataset = ?",
+                (dataset,),
+            ).fetchall()
+
+        values = {(latitude, longitude): value for latitude, longitude, value in rows}
+        return {
+            city: json.loads(values[(city.latitude, city.longitude)])
+            for city in cities
+            if (city.latitude, city.longitude) in values
+        }
+
+    def put(self, dataset: str, results: dict[City, Any]) -> None:
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                [
+                    (dataset, city.latitude, city.longitude, json.dumps(value))
+                    for city, value in results.items()
+                ],
+            )
+
+
+class Checkpoints:
+    """Results of the stages of the last run, so that it can be resumed.
+
+    Unlike the ones of ResultStore, they are thrown away when a new run starts
+    without resuming the previous one.
+    """
+
+    def __init__(self, path: Path, resume: bool) -> None:
+        self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+                """,
+            )
+            if not resume:
+                self.connection.execute("DELETE FROM checkpoints")
+
+    def run(
+        self,
+        name: str,
+        compute: Callable[[], T],
+        encode: Callable[[T], Any] = lambda value: value,
+        decode: Callable[[Any], T] = lambda value: value,
+    ) -> T:
+        """Return the result of the given stage, computing it only if needed."""
+        row = self.connection.execute(
+            "SELECT value FROM checkpoints WHERE name = ?",
+            (name,),
+        ).fetchone()
+
+        if row is not None:
+            print(f"Resuming from checkpoint {name}")
+            return decode(json.loads(row[0]))
+
+        value = compute()
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?)",
+                (name, json.dumps(encode(value))),
+            )
+
+        return value
+
+
+@dataclass(frozen=True)
+class Stage:
+    """Step of the generation of the maps, see BuildGraph."""
+
+    name: str
+    # Called with the results of the dependencies, in order.
+    compute: Callable[..., Any]
+    dependencies: tuple[str, ...] = ()
+    # What the result depends on besides the dependencies: options, versions...
+    parameters: Any = None
+    # Files written by the stage, it's run again if they don't match the last run.
+    outputs: tuple[Path, ...] = ()
+    # For stages depending on data published elsewhere, which check by themselves
+    # whether it changed. Stages depending on them still only run if their
+    # result changed.
+    always_run: bool = False
+    encode: Callable[[Any], Any] = lambda value: value
+    decode: Callable[[Any], Any] = lambda value: value
+
+
+class BuildGraph:
+    """Run stages like make does, only when their inputs changed since the last run.
+
+    The inputs of a stage are its parameters and the results of its dependencies,
+    compared through their hashes. A stage whose result didn't change doesn't make
+    the stages depending on it stale.
+    """
+
+    def __init__(self, path: Path, stages: Iterable[Stage]) -> None:
+        self.stages = {stage.name: stage for stage in stages}
+        self.values: dict[str, Any] = {}
+        self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stages (
+                    name TEXT PRIMARY KEY,
+                    inputs_hash TEXT NOT NULL,
+                    outputs_hash TEXT NOT NULL,
+                    result_hash TEXT NOT NULL,
+                    value TEXT NOT NULL
+                )
+                """,
+            )
+
+    def order(self, targets: Iterable[str]) -> list[str]:
+        """Return the targets and the stages they depend on, dependencies first."""
+        ordered_names: list[str] = []
+
+        def visit(name: str) -> None:
+            if name in ordered_names:
+                return
+            for dependency in self.stages[name].dependencies:
+                visit(dependency)
+            ordered_names.append(name)
+
+        for target in targets:
+            visit(target)
+
+        return ordered_names
+
+    def last_run(self, name: str) -> tuple[str, str, str] | None:
+        """Return the inputs, outputs and result hashes of the last run of a stage."""
+        return self.connection.execute(
+            "SELECT inputs_hash, outputs_hash, result_hash FROM stages WHERE name = ?",
+            (name,),
+        ).fetchone()
+
+    def inputs_hash(self, stage: Stage, dependencies_hashes: list[str]) -> str:
+        inputs = json.dumps([stage.parameters, dependencies_hashes], sort_keys=True)
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+    def outputs_hash(self, stage: Stage) -> str:
+        outputs_hash = hashlib.sha256()
+        for output in stage.outputs:
+            outputs_hash.update(
+                hashlib.sha256(output.read_bytes()).digest()
+                if output.exists()
+                else b"missing",
+            )
+
+        return outputs_hash.hexdigest()
+
+    def is_up_to_date(self, stage: Stage, dependencies_hashes: list[str]) -> bool:
+        last_run = self.last_run(stage.name)
+        return (
+            not stage.always_run
+            and last_run is not None
+            and last_run[0] == self.inputs_hash(stage, dependencies_hashes)
+            and last_run[1] == self.outputs_hash(stage)
+        )
+
+    def stale_stages(
+        self,
+        targets: Iterable[str],
+        forced: Iterable[str] = (),
+    ) -> list[str]:
+        """Return the stages that building the targets would run.
+
+        A stage depending on a stale one is considered stale too, even though it
+        won't run if the result of its dependency turns out to be the same.
+        Stages which always run are left out unless forced: whether their result
+        changes is only known once they ran.
+        """
+        stale_names: list[str] = []
+        for name in self.order(targets):
+            stage = self.stages[name]
+            if stage.always_run and name not in forced:
+                continue
+
+            dependencies_runs = [
+                self.last_run(dependency) for dependency in stage.dependencies
+            ]
+
+            if (
+                name in forced
+                or any(dependency in stale_names for dependency in stage.dependencies)
+                or not self.is_up_to_date(
+                    stage,
+                    [last_run[2] for last_run in dependencies_runs if last_run],
+                )
+            ):
+                stale_names.append(name)
+
+        return stale_names
+
+    def value(self, name: str) -> Any:
+        if name not in self.values:
+            (value,) = self.connection.execute(
+                "SELECT value FROM stages WHERE name = ?",
+                (name,),
+            ).fetchone()
+            self.values[name] = self.stages[name].decode(json.loads(value))
+
+        return self.values[name]
+
+    def build(self, targets: Iterable[str], forced: Iterable[str] = ()) -> None:
+        """Run the stale stages needed by the targets."""
+        result_hashes: dict[str, str] = {}
+        for name in self.order(targets):
+            stage = self.stages[name]
+            dependencies_hashes = [
+                result_hashes[dependency] for dependency in stage.dependencies
+            ]
+
+            if name not in forced and self.is_up_to_date(stage, dependencies_hashes):
+                print(f"Stage {name} is up to date")
+                result_hashes[name] = self.last_run(name)[2]  # type: ignore []
+                continue
+
+            print(f"Running stage {name}...")
+            value = stage.compute(
+                *(self.value(dependency) for dependency in stage.dependencies),
+            )
+            encoded_value = json.dumps(stage.encode(value), sort_keys=True)
+            result_hashes[name] = hashlib.sha256(encoded_value.encode()).hexdigest()
+            self.values[name] = value
+
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        self.inputs_hash(stage, dependencies_hashes),
+                        self.outputs_hash(stage),
+                        result_hashes[name],
+                        encoded_value,
+                    ),
+                )
+
+
+def fetch_per_city_stored(
+    store: ResultStore,
+    dataset: str,
+    fetch_batch: Callable[[list[City]], dict[City, T]],
+    cities: Iterable[City],
+    encode: Callable[[T], Any],
+    decode: Callable[[Any], T],
+) -> dict[City, T]:
+    """Same as fetch_per_city, but only for the cities missing from the store.
+
+    The results of every batch are saved as soon as they are available.
+    """
+    cities = list(cities)
+    stored_results = {
+        city: decode(value) for city, value in store.get(dataset, cities).items()
+    }
+
+    def fetch_and_store_batch(batch: list[City]) -> dict[City, T]:
+        results = fetch_batch(batch)
+        store.put(dataset, {city: encode(result) for city, result in results.items()})
+        return results
+
+    missing_cities = [city for city in cities if city not in stored_results]
+    if len(missing_cities) < len(cities):
+        print(
+            f"{len(cities) - len(missing_cities)} cities found in {dataset}, "
+            f"{len(missing_cities)} left to process",
+        )
+
+    results = stored_results | fetch_per_city(fetch_and_store_batch, missing_cities)
+    return {city: results[city] for city in cities}
+
+
+def requests_get_meteo_batch(url: str, cities: list[City], params: dict) -> bytes:
+    """Send a single multi-location request, see split_meteo_response."""
+    return requests_get_meteo_content(
+        url,
+        params={
+            "latitude": ",".join(str(city.latitude) for city in cities),
+            "longitude": ",".join(str(city.longitude) for city in cities),
+            **params,
+        },
+    )
+
+
+def split_meteo_response(
+    cities: list[City],
+    content: bytes,
+) -> dict[City, dict[str, Any]]:
+    """Decode the response to a multi-location request and split it per city."""
+    # A 30 years weather history is several megabytes of JSON.
+    json_content = decode_json(content)
+
+    # The API returns a list only when more than one location is requested.
+    if isinstance(json_content, dict):
+        json_content = [json_content]
+
+    return dict(zip(cities, json_content, strict=True))
+
+
+def request_weather_batch(
+    cities: list[City],
+    start_date: date,
+    end_date: date,
+) -> bytes:
+    return requests_get_meteo_batch(
         "https://archive-api.open-meteo.com/v1/archive",
+        cities,
         params={
-            "latitude": city.latitude,
-            "longitude": city.longitude,
             "start_date": str(start_date),
             "end_date": str(end_date),
             "daily": [
@@ -191,369 +867,293 @@ def get_weather(city: City, start_date: date, end_date: date) -> dict[date, Weat
         },
     )
 
-    json_content = json_content["daily"]
 
-    time = json_content["time"]
-    temperature_2m_max = json_content["temperature_2m_max"]
-    temperature_2m_min = json_content["temperature_2m_min"]
-    temperature_2m_mean = json_content["temperature_2m_mean"]
-    apparent_temperature_max = json_content["apparent_temperature_max"]
-    apparent_temperature_min = json_content["apparent_temperature_min"]
-    apparent_temperature_mean = json_content["apparent_temperature_mean"]
-    daylight_duration = json_content["daylight_duration"]
-    sunshine_duration = json_content["sunshine_duration"]
-    shortwave_radiation_sum = json_content["shortwave_radiation_sum"]
-    wind_speed_10m_max = json_content["wind_speed_10m_max"]
-    rain_sum = json_content["rain_sum"]
-    snowfall_sum = json_content["snowfall_sum"]
-    precipitation_hours = json_content["precipitation_hours"]
-    et0_fao_evapotranspiration = json_content["et0_fao_evapotranspiration"]
-
-    measurements: dict[date, Weather] = {}
-    for i in range(len(time)):
-        year, month, day = time[i].split("-")
-        year, month, day = int(year), int(month), int(day)
-
-        # Sometimes there's a hole in the data (sensor failure?)
-        # it is quite rare but if it happens, we just throw the data away
-        if temperature_2m_max[i] is None:
-            print(f"WARNING: temperature_2m_max is None, skipping {time[i]}")
-            continue
+def parse_weather_batch(
+    cities: list[City],
+    content: bytes,
+) -> dict[City, WeatherSeries]:
+    weather_per_city = {}
+    for city, json_content in split_meteo_response(cities, content).items():
+        weather_per_city[city] = parse_weather(json_content)
+        warn_about_missing_days(city, weather_per_city[city])
 
-        if temperature_2m_min[i] is None:
-            print(f"WARNING: temperature_2m_min is None, skipping {time[i]}")
-            continue
+    return weather_per_city
 
-        if temperature_2m_mean[i] is None:
-            print(f"WARNING: temperature_2m_mean is None, skipping {time[i]}")
-            continue
 
-        if apparent_temperature_max[i] is None:
-            print(f"WARNING: apparent_temperature_max is None, skipping {time[i]}")
-            continue
+def parse_weather(json_content: dict[str, Any]) -> WeatherSeries:
+    json_content = json_content["daily"]
 
-        if apparent_temperature_min[i] is None:
-            print(f"WARNING: apparent_temperature_min is None, skipping {time[i]}")
-            continue
+    time = np.array(json_content["time"], dtype="datetime64[D]")
+    values = np.array(
+        [json_content[variable] for variable in WEATHER_DAILY_VARIABLES],
+        dtype=np.float64,  # None values are turned into NaN
+    ).T
+
+    values[:, WEATHER_FIELDS.index("daylight_duration")] /= 3600  # convert to hours
+    values[:, WEATHER_FIELDS.index("sunshine_duration")] /= 3600  # convert to hours
+    values[:, WEATHER_FIELDS.index("snowfall_sum")] *= 10  # convert to mm
+
+    return WeatherSeries(time, values)
+
+
+def warn_about_missing_days(city: City, weather: WeatherSeries) -> None:
+    # Sometimes there's a hole in the data (sensor failure?)
+    # it is quite rare but if it happens, the whole day is ignored
+    # when computing the aggregates.
+    is_missing = np.isnan(weather.values)
+    missing_days_count = int(is_missing.any(axis=1).sum())
+    if not missing_days_count:
+        return
+
+    missing_values = ", ".join(
+        f"{variable}: {count}"
+        for variable, count in zip(
+            WEATHER_DAILY_VARIABLES,
+            is_missing.sum(axis=0).tolist(),
+            strict=True,
+        )
+        if count
+    )
+    print(
+        f"WARNING: skipping {missing_days_count} days with missing values "
+        f"for {city.name} in {city.departement} ({missing_values})",
+    )
 
-        if apparent_temperature_mean[i] is None:
-            print(f"WARNING: apparent_temperature_mean is None, skipping {time[i]}")
-            continue
 
-        if wind_speed_10m_max[i] is None:
-            print(f"WARNING: wind_speed_10m_max is None, skipping {time[i]}")
-            continue
+def expand_along(weights: Any, axis: int, ndim: int) -> np.ndarray:
+    """Reshape 1D weights so that they broadcast along an axis of an array."""
+    shape = [1] * ndim
+    shape[axis] = -1
+    return np.asarray(weights, dtype=np.float64).reshape(shape)
 
-        if daylight_duration[i] is None:
-            print(f"WARNING: daylight_duration is None, skipping {time[i]}")
-            continue
 
-        if sunshine_duration[i] is None:
-            print(f"WARNING: sunshine_duration is None, skipping {time[i]}")
-            continue
+def total(
+    values: Any,
+    axis: int = 0,
+    *,
+    groups: Any = None,
+    groups_count: int | None = None,
+    skip_nan: bool = False,
+    exact: bool = False,
+) -> np.ndarray:
+    """Sum the values along an axis.
 
-        if shortwave_radiation_sum[i] is None:
-            print(f"WARNING: shortwave_radiation_sum is None, skipping {time[i]}")
-            continue
+    With groups, the group of each position along the axis, there is a sum for
+    each group from 0 to groups_count - 1 instead. Missing values count as 0
+    with skip_nan.
 
-        if rain_sum[i] is None:
-            print(f"WARNING: rain_sum is None, skipping {time[i]}")
-            continue
+    NumPy's sums are accurate enough for aggregates. The exact sum, correctly
+    rounded like math.fsum, is much slower on long axes.
+    """
+    array = np.asarray(values, dtype=np.float64)
+    if skip_nan:
+        array = np.where(np.isnan(array), 0.0, array)
+
+    if groups is None:
+        if exact:
+            return np.apply_along_axis(math.fsum, axis, array)
+        return array.sum(axis=axis)
+
+    groups = np.asarray(groups, dtype=np.intp)
+    if groups_count is None:
+        groups_count = int(groups.max(initial=-1)) + 1
+
+    # The axis is moved first, the other ones are flattened into columns.
+    array = np.moveaxis(array, axis, 0)
+    columns = array.reshape(len(groups), -1)
+    if exact:
+        order = np.argsort(groups, kind="stable")
+        bounds = np.cumsum(np.bincount(groups, minlength=groups_count))[:-1]
+        sums = np.array(
+            [
+                [math.fsum(column) for column in group.T]
+                for group in np.split(columns[order], bounds)
+            ],
+        )
+    else:
+        # A single bincount sums every column of every group.
+        index = groups[:, np.newaxis] * columns.shape[1] + np.arange(columns.shape[1])
+        sums = np.bincount(
+            index.ravel(),
+            weights=columns.ravel(),
+            minlength=groups_count * columns.shape[1],
+        )
 
-        if snowfall_sum[i] is None:
-            print(f"WARNING: snowfall_sum is None, skipping {time[i]}")
-            continue
+    return np.moveaxis(sums.reshape(groups_count, *array.shape[1:]), 0, axis)
 
-        if precipitation_hours[i] is None:
-            print(f"WARNING: precipitation_hours is None, skipping {time[i]}")
-            continue
 
-        if et0_fao_evapotranspiration[i] is None:
-            print(f"WARNING: et0_fao_evapotranspiration is None, skipping {time[i]}")
-            continue
+def average(
+    values: Any,
+    axis: int = 0,
+    weights: Any = None,
+    *,
+    groups: Any = None,
+    groups_count: int | None = None,
+    skip_nan: bool = False,
+    exact: bool = False,
+) -> np.ndarray:
+    """Return the mean, or the weighted mean, of the values along an axis.
 
-        dw = Weather(
-            temperature_2m_max[i],
-            temperature_2m_min[i],
-            temperature_2m_mean[i],
-            apparent_temperature_max[i],
-            apparent_temperature_min[i],
-            apparent_temperature_mean[i],
-            wind_speed_10m_max[i],
-            daylight_duration[i] / 3600,  # convert to hours
-            sunshine_duration[i] / 3600,  # convert to hours
-            shortwave_radiation_sum[i],
-            rain_sum[i],
-            snowfall_sum[i] * 10,  # convert to mm
-            precipitation_hours[i],
-            et0_fao_evapotranspiration[i],
+    With groups, there is a mean for each group, see total. Missing values are
+    ignored with skip_nan.
+    """
+    array = np.asarray(values, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(array.shape[axis])
+
+    # Weights are given to every value so that the missing ones can be left out.
+    weights = np.broadcast_to(expand_along(weights, axis, array.ndim), array.shape)
+    if skip_nan:
+        weights = np.where(np.isnan(array), 0.0, weights)
+
+    def group_total(values: np.ndarray) -> np.ndarray:
+        return total(
+            values,
+            axis,
+            groups=groups,
+            groups_count=groups_count,
+            skip_nan=skip_nan,
+            exact=exact,
         )
-        measurements[date(year, month, day)] = dw
 
-    return measurements
+    return group_total(array * weights) / group_total(weights)
+
+
+def variance(
+    values: Any,
+    axis: int = 0,
+    weights: Any = None,
+    *,
+    exact: bool = False,
+) -> np.ndarray:
+    """Return the population variance, or the weighted one, along an axis."""
+    array = np.asarray(values, dtype=np.float64)
+    # Two passes, the deviations from the mean don't suffer from cancellation
+    # the way the difference of the mean of squares and the squared mean does.
+    deviations = array - np.expand_dims(
+        average(array, axis, weights, exact=exact),
+        axis,
+    )
+    return average(deviations**2, axis, weights, exact=exact)
 
 
-def compute_average_weather(weather_measurements: list[Weather]) -> Weather:
-    temperature_2m_max_values = [wm.temperature_2m_max for wm in weather_measurements]
-    temperature_2m_min_values = [wm.temperature_2m_min for wm in weather_measurements]
-    temperature_2m_mean_values = [wm.temperature_2m_mean for wm in weather_measurements]
-    apparent_temperature_max_values = [
-        wm.apparent_temperature_max for wm in weather_measurements
-    ]
-    apparent_temperature_min_values = [
-        wm.apparent_temperature_min for wm in weather_measurements
-    ]
-    apparent_temperature_mean_values = [
-        wm.apparent_temperature_mean for wm in weather_measurements
-    ]
-    wind_speed_10m_max_values = [wm.wind_speed_10m_max for wm in weather_measurements]
-    daylight_duration_values = [wm.daylight_duration for wm in weather_measurements]
-    sunshine_duration_values = [wm.sunshine_duration for wm in weather_measurements]
-    shortwave_radiation_sum_values = [
-        wm.shortwave_radiation_sum for wm in weather_measurements
-    ]
-    rain_sum_values = [wm.rainfall_sum for wm in weather_measurements]
-    snowfall_sum_values = [wm.snowfall_sum for wm in weather_measurements]
-    precipitation_hours_values = [wm.precipitation_hours for wm in weather_measurements]
-    et0_fao_evapotranspiration_values = [
-        wm.et0_fao_evapotranspiration for wm in weather_measurements
-    ]
+def extent(
+    values: Any,
+    axis: int = 0,
+    *,
+    skip_nan: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return the minimum and the maximum of the values along an axis.
 
-    return Weather(
-        temperature_2m_max=mean(temperature_2m_max_values),
-        temperature_2m_min=mean(temperature_2m_min_values),
-        temperature_2m_mean=mean(temperature_2m_mean_values),
-        apparent_temperature_max=mean(apparent_temperature_max_values),
-        apparent_temperature_min=mean(apparent_temperature_min_values),
-        apparent_temperature_mean=mean(apparent_temperature_mean_values),
-        wind_speed_10m_max=mean(wind_speed_10m_max_values),
-        daylight_duration=mean(daylight_duration_values),
-        sunshine_duration=mean(sunshine_duration_values),
-        shortwave_radiation_sum=mean(shortwave_radiation_sum_values),
-        rainfall_sum=mean(rain_sum_values),
-        snowfall_sum=mean(snowfall_sum_values),
-        precipitation_hours=mean(precipitation_hours_values),
-        et0_fao_evapotranspiration=mean(et0_fao_evapotranspiration_values),
-    )
+    Missing values are ignored with skip_nan.
+    """
+    array = np.asarray(values, dtype=np.float64)
+    if skip_nan:
+        return np.nanmin(array, axis=axis), np.nanmax(array, axis=axis)
+    return array.min(axis=axis), array.max(axis=axis)
 
 
 def compute_average_season_weather(
-    weather_measurements: dict[date, Weather],
+    weather_measurements: WeatherSeries,
 ) -> tuple[Weather, Weather]:
     """Process winter and summer means given all the input measurements.
 
     Winter is considered to last over december, january and february.
     Summer is considered to last over june, july and august.
     """
-    years_to_process = {date.year for date in weather_measurements}
-
-    winter_temperature_2m_max_values = []
-    winter_temperature_2m_min_values = []
-    winter_temperature_2m_values = []
-    winter_apparent_temparature_max_values = []
-    winter_apparent_temparature_min_values = []
-    winter_apparent_temparature_mean_values = []
-    winter_wind_speed_10m_max_values = []
-    winter_daylight_duration_values = []
-    winter_sunshine_duration_values = []
-    winter_shortwave_radiation_sum_values = []
-    winter_rain_sum_values = []
-    winter_snowfall_sum_values = []
-    winter_precipitation_hours_values = []
-    winter_et0_fao_evapotranspiration_values = []
-
-    summer_temperature_2m_max_values = []
-    summer_temperature_2m_min_values = []
-    summer_temperature_2m_values = []
-    summer_apparent_temparature_max_values = []
-    summer_apparent_temparature_min_values = []
-    summer_apparent_temparature_mean_values = []
-    summer_wind_speed_10m_max_values = []
-    summer_daylight_duration_values = []
-    summer_sunshine_duration_values = []
-    summer_shortwave_radiation_sum_values = []
-    summer_rain_sum_values = []
-    summer_snowfall_sum_values = []
-    summer_precipitation_hours_values = []
-    summer_et0_fao_evapotranspiration_values = []
-
-    for year in years_to_process:
-        weather_measurements_for_the_given_year = {
-            date: wm for date, wm in weather_measurements.items() if date.year == year
-        }
-        weather_measurements_in_december = [
-            wm
-            for date, wm in weather_measurements_for_the_given_year.items()
-            if date.month == 12
-        ]
-        weather_measurements_in_january = [
-            wm
-            for date, wm in weather_measurements_for_the_given_year.items()
-            if date.month == 1
-        ]
-        weather_measurements_in_february = [
-            wm
-            for date, wm in weather_measurements_for_the_given_year.items()
-            if date.month == 2
-        ]
-        weather_measurements_in_june = [
-            wm
-            for date, wm in weather_measurements_for_the_given_year.items()
-            if date.month == 6
-        ]
-        weather_measurements_in_july = [
-            wm
-            for date, wm in weather_measurements_for_the_given_year.items()
-            if date.month == 7
-        ]
-        weather_measurements_in_august = [
-            wm
-            for date, wm in weather_measurements_for_the_given_year.items()
-            if date.month == 8
-        ]
-
-        winter_measurements_to_process = (
-            weather_measurements_in_december
-            + weather_measurements_in_january
-            + weather_measurements_in_february
-        )
-
-        summer_measurements_to_process = (
-            weather_measurements_in_june
-            + weather_measurements_in_july
-            + weather_measurements_in_august
-        )
+    return compute_average_season_weather_batch([weather_measurements])[0]
 
-        # Rainfall and snowfall are processed separately because we want
-        # the total fall over the season instead of performing a daily mean.
-        winter_rain_sum_values.append(
-            sum(wm.rainfall_sum for wm in winter_measurements_to_process),
-        )
-        winter_snowfall_sum_values.append(
-            sum(wm.snowfall_sum for wm in winter_measurements_to_process),
-        )
-        winter_et0_fao_evapotranspiration_values.append(
-            sum(wm.et0_fao_evapotranspiration for wm in winter_measurements_to_process),
-        )
-        summer_rain_sum_values.append(
-            sum(wm.rainfall_sum for wm in summer_measurements_to_process),
-        )
-        summer_snowfall_sum_values.append(
-            sum(wm.snowfall_sum for wm in summer_measurements_to_process),
-        )
-        summer_et0_fao_evapotranspiration_values.append(
-            sum(wm.et0_fao_evapotranspiration for wm in summer_measurements_to_process),
-        )
 
-        for weather_measurement in winter_measurements_to_process:
-            winter_temperature_2m_max_values.append(
-                weather_measurement.temperature_2m_max,
-            )
-            winter_temperature_2m_min_values.append(
-                weather_measurement.temperature_2m_min,
-            )
-            winter_temperature_2m_values.append(weather_measurement.temperature_2m_mean)
-            winter_apparent_temparature_max_values.append(
-                weather_measurement.apparent_temperature_max,
-            )
-            winter_apparent_temparature_min_values.append(
-                weather_measurement.apparent_temperature_min,
-            )
-            winter_apparent_temparature_mean_values.append(
-                weather_measurement.apparent_temperature_mean,
-            )
-            winter_wind_speed_10m_max_values.append(
-                weather_measurement.wind_speed_10m_max,
-            )
-            winter_daylight_duration_values.append(
-                weather_measurement.daylight_duration,
-            )
-            winter_sunshine_duration_values.append(
-                weather_measurement.sunshine_duration,
-            )
-            winter_shortwave_radiation_sum_values.append(
-                weather_measurement.shortwave_radiation_sum
-            )
-            winter_precipitation_hours_values.append(
-                weather_measurement.precipitation_hours,
-            )
+def compute_average_season_weather_batch(
+    weather_measurements: list[WeatherSeries],
+) -> list[tuple[Weather, Weather]]:
+    """Process winter and summer means of several cities at once.
 
-        for weather_measurement in summer_measurements_to_process:
-            summer_temperature_2m_max_values.append(
-                weather_measurement.temperature_2m_max,
-            )
-            summer_temperature_2m_min_values.append(
-                weather_measurement.temperature_2m_min,
-            )
-            summer_temperature_2m_values.append(weather_measurement.temperature_2m_mean)
-            summer_apparent_temparature_max_values.append(
-                weather_measurement.apparent_temperature_max,
-            )
-            summer_apparent_temparature_min_values.append(
-                weather_measurement.apparent_temperature_min,
-            )
-            summer_apparent_temparature_mean_values.append(
-                weather_measurement.apparent_temperature_mean,
-            )
-            summer_wind_speed_10m_max_values.append(
-                weather_measurement.wind_speed_10m_max,
-            )
-            summer_daylight_duration_values.append(
-                weather_measurement.daylight_duration,
-            )
-            summer_sunshine_duration_values.append(
-                weather_measurement.sunshine_duration,
-            )
-            summer_shortwave_radiation_sum_values.append(
-                weather_measurement.shortwave_radiation_sum
-            )
-            summer_precipitation_hours_values.append(
-                weather_measurement.precipitation_hours,
-            )
+    Days with a missing measurement are thrown away. Rainfall, snowfall and
+    evapotranspiration are summed over each season of each year, then averaged
+    over the years. The other fields are daily means over all the seasons.
+    """
+    if not weather_measurements:
+        return []
+
+    time = weather_measurements[0].time
+    if any(not np.array_equal(wm.time, time) for wm in weather_measurements):
+        return [
+            season_weather
+            for wm in weather_measurements
+            for season_weather in compute_average_season_weather_batch([wm])
+        ]
 
-    return (
-        Weather(
-            temperature_2m_max=mean(winter_temperature_2m_max_values),
-            temperature_2m_min=mean(winter_temperature_2m_min_values),
-            temperature_2m_mean=mean(winter_temperature_2m_values),
-            apparent_temperature_max=mean(winter_apparent_temparature_max_values),
-            apparent_temperature_min=mean(winter_apparent_temparature_min_values),
-            apparent_temperature_mean=mean(winter_apparent_temparature_mean_values),
-            wind_speed_10m_max=mean(winter_wind_speed_10m_max_values),
-            daylight_duration=mean(winter_daylight_duration_values),
-            sunshine_duration=mean(winter_sunshine_duration_values),
-            shortwave_radiation_sum=mean(winter_shortwave_radiation_sum_values),
-            rainfall_sum=mean(winter_rain_sum_values),
-            snowfall_sum=mean(winter_snowfall_sum_values),
-            precipitation_hours=mean(winter_precipitation_hours_values),
-            et0_fao_evapotranspiration=mean(winter_et0_fao_evapotranspiration_values),
-        ),
-        Weather(
-            temperature_2m_max=mean(summer_temperature_2m_max_values),
-            temperature_2m_min=mean(summer_temperature_2m_min_values),
-            temperature_2m_mean=mean(summer_temperature_2m_values),
-            apparent_temperature_max=mean(summer_apparent_temparature_max_values),
-            apparent_temperature_min=mean(summer_apparent_temparature_min_values),
-            apparent_temperature_mean=mean(summer_apparent_temparature_mean_values),
-            wind_speed_10m_max=mean(summer_wind_speed_10m_max_values),
-            daylight_duration=mean(summer_daylight_duration_values),
-            sunshine_duration=mean(summer_sunshine_duration_values),
-            shortwave_radiation_sum=mean(summer_shortwave_radiation_sum_values),
-            rainfall_sum=mean(summer_rain_sum_values),
-            snowfall_sum=mean(summer_snowfall_sum_values),
-            precipitation_hours=mean(summer_precipitation_hours_values),
-            et0_fao_evapotranspiration=mean(summer_et0_fao_evapotranspiration_values),
-        ),
-    )
+    values = np.stack([wm.values for wm in weather_measurements])
+    cities_count = len(weather_measurements)
+    is_complete = ~np.isnan(values).any(axis=2)
+
+    years = time.astype("datetime64[Y]").astype(int)
+    year_index = years - years.min()
+    years_count = int(year_index.max()) + 1
+    months = time.astype("datetime64[M]").astype(int) % 12 + 1
+
+    # Each day of each city goes in the group of its season, the days which
+    # are incomplete or out of season are gathered in group 0 which is ignored.
+    city_index = np.arange(cities_count)[:, np.newaxis]
+    seasons = SEASON_OF_MONTH[months]
+    groups = np.where(
+        is_complete & (seasons != IGNORED_SEASON),
+        city_index * SEASONS_COUNT + seasons + 1,
+        0,
+    ).ravel()
+    groups_count = cities_count * SEASONS_COUNT + 1
+
+    days_count = total(
+        np.ones(len(groups)),
+        groups=groups,
+        groups_count=groups_count,
+    )[1:]
+    sums = total(
+        values.reshape(-1, len(WEATHER_FIELDS)),
+        groups=groups,
+        groups_count=groups_count,
+    )[1:]
+
+    # The mean of the season sums over the years is the total of all seasons
+    # divided by the number of years which have at least one measurement.
+    years_with_measurements = total(
+        is_complete.ravel(),
+        groups=(city_index * years_count + year_index).ravel(),
+        groups_count=cities_count * years_count,
+    ).reshape(cities_count, years_count)
+    years_to_process = np.count_nonzero(years_with_measurements, axis=1)
+
+    # A mean over no day would be NaN, and spread to the department values.
+    if (days_count == 0).any() or (years_to_process == 0).any():
+        error = "A city has no complete day of measurements in winter or summer"
+        raise ClimateError(error)
+
+    means = np.where(
+        np.isin(WEATHER_FIELDS, WEATHER_SEASON_SUM_FIELDS),
+        sums / np.repeat(years_to_process, SEASONS_COUNT)[:, np.newaxis],
+        sums / days_count[:, np.newaxis],
+    ).reshape(cities_count, SEASONS_COUNT, len(WEATHER_FIELDS))
+
+    return [
+        (
+            Weather(*means[i, WINTER].tolist()),
+            Weather(*means[i, SUMMER].tolist()),
+        )
+        for i in range(cities_count)
+    ]
 
 
 # TODO: use https://www.geodair.fr/donnees/consultation instead
-def get_air_quality_mean(city: City, start_date: date, end_date: date) -> AirQuality:
-    json_content = requests_get_meteo(
+def request_air_quality_batch(
+    cities: list[City],
+    start_date: date,
+    end_date: date,
+) -> bytes:
+    return requests_get_meteo_batch(
         "https://air-quality-api.open-meteo.com/v1/air-quality",
+        cities,
         params={
-            "latitude": city.latitude,
-            "longitude": city.longitude,
             "hourly": [
                 "european_aqi,european_aqi_pm2_5",
                 "european_aqi_pm10",
@@ -566,121 +1166,448 @@ def get_air_quality_mean(city: City, start_date: date, end_date: date) -> AirQua
         },
     )
 
-    json_content = json_content["hourly"]
 
-    european_aqi = [v for v in json_content["european_aqi"] if v is not None]
-    european_aqi_pm2_5 = [
-        v for v in json_content["european_aqi_pm2_5"] if v is not None
-    ]
-    european_aqi_pm10 = [v for v in json_content["european_aqi_pm10"] if v is not None]
-    european_aqi_nitrogen_dioxide = [
-        v for v in json_content["european_aqi_nitrogen_dioxide"] if v is not None
+def compute_air_quality_mean_batch(
+    cities: list[City],
+    content: bytes,
+) -> dict[City, AirQuality]:
+    json_content_per_city = split_meteo_response(cities, content)
+    hourly_values = [
+        parse_air_quality(json_content)
+        for json_content in json_content_per_city.values()
     ]
-    european_aqi_ozone = [
-        v for v in json_content["european_aqi_ozone"] if v is not None
-    ]
-    european_aqi_sulphur_dioxide = [
-        v for v in json_content["european_aqi_sulphur_dioxide"] if v is not None
+    # The cities are reduced all at once, unless their histories don't line up.
+    if len({values.shape for values in hourly_values}) == 1:
+        air_qualities = compute_air_quality_batch(np.stack(hourly_values))
+    else:
+        air_qualities = [
+            compute_air_quality_batch(values[np.newaxis])[0] for values in hourly_values
+        ]
+
+    return dict(zip(json_content_per_city, air_qualities, strict=True))
+
+
+AIR_QUALITY_HOURLY_VARIABLES = (
+    "european_aqi",
+    "european_aqi_pm2_5",
+    "european_aqi_pm10",
+    "european_aqi_nitrogen_dioxide",
+    "european_aqi_ozone",
+    "european_aqi_sulphur_dioxide",
+)
+
+# Percentiles of the AirQuality fields, which show pollution peaks.
+AIR_QUALITY_PERCENTILES = (95, 99)
+
+
+def parse_air_quality(json_content: dict[str, Any]) -> np.ndarray:
+    """Return the hourly values of the indices, one column per index."""
+    json_content = json_content["hourly"]
+    return np.array(
+        [json_content[variable] for variable in AIR_QUALITY_HOURLY_VARIABLES],
+        dtype=np.float64,  # None values are turned into NaN
+    ).T
+
+
+def compute_air_quality_batch(hourly_values: np.ndarray) -> list[AirQuality]:
+    """Reduce the hourly values of several cities, stacked along the first axis.
+
+    Missing values are ignored.
+    """
+    if np.isnan(hourly_values).all(axis=1).any():
+        error = "An air quality index has no value at all"
+        raise AirQualityError(error)
+
+    # Indices are integers, their bounds are kept as such.
+    minimums, maximums = extent(hourly_values, axis=1, skip_nan=True)
+    minimums = minimums.astype(np.int64)
+    maximums = maximums.astype(np.int64)
+    means = average(hourly_values, axis=1, skip_nan=True)
+    percentiles = np.nanpercentile(hourly_values, AIR_QUALITY_PERCENTILES, axis=1)
+
+    return [
+        AirQuality(
+            *minimums[i].tolist(),
+            *maximums[i].tolist(),
+            *means[i].tolist(),
+            *percentiles[:, i].ravel().tolist(),
+        )
+        for i in range(len(hourly_values))
     ]
 
-    return AirQuality(
-        european_aqi_min=min(european_aqi),
-        european_aqi_pm2_5_min=min(european_aqi_pm2_5),
-        european_aqi_pm10_min=min(european_aqi_pm10),
-        european_aqi_nitrogen_dioxide_min=min(european_aqi_nitrogen_dioxide),
-        european_aqi_ozone_min=min(european_aqi_ozone),
-        european_aqi_sulphur_dioxide_min=min(european_aqi_sulphur_dioxide),
-        european_aqi_max=max(european_aqi),
-        european_aqi_pm2_5_max=max(european_aqi_pm2_5),
-        european_aqi_pm10_max=max(european_aqi_pm10),
-        european_aqi_nitrogen_dioxide_max=max(european_aqi_nitrogen_dioxide),
-        european_aqi_ozone_max=max(european_aqi_ozone),
-        european_aqi_sulphur_dioxide_max=max(european_aqi_sulphur_dioxide),
-        european_aqi_mean=mean(european_aqi),
-        european_aqi_pm2_5_mean=mean(european_aqi_pm2_5),
-        european_aqi_pm10_mean=mean(european_aqi_pm10),
-        european_aqi_nitrogen_dioxide_mean=mean(european_aqi_nitrogen_dioxide),
-        european_aqi_ozone_mean=mean(european_aqi_ozone),
-        european_aqi_sulphur_dioxide_mean=mean(european_aqi_sulphur_dioxide),
-    )
 
+def write_response(resp: requests.Response, file: BinaryIO) -> str:
+    """Write the content of resp into file chunk by chunk, return its SHA-256."""
+    digest = hashlib.sha256()
+    for chunk in resp.iter_content(chunk_size=1024 * 1024):
+        file.write(chunk)
+        digest.update(chunk)
 
-def get_referenced_natural_disaster_count() -> dict[str, int]:
-    resp = requests.get(
-        "http://files.georisques.fr/GASPAR/gaspar.zip",
-        timeout=HTTP_TIMEOUT,
-    )
-    f = ZipFile(BytesIO(resp.content))
+    return digest.hexdigest()
 
-    natural_disasters_count_per_department = {code: 0 for code in DEPARTMENTS}
 
-    with f.open("catnat_gaspar.csv", "r") as csv_file:
-        csv_reader = csv.reader(TextIOWrapper(csv_file), delimiter=";")
-        next(csv_reader)  # skip header
+def download_file(url: str, path: Path) -> Path:
+    """Download url into path, unless it has already been downloaded."""
+    if path.exists():
+        return path
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Big files are written to disk as they come instead of the HTTP cache.
+    with (
+        requests_cache.disabled(),
+        requests.get(url, stream=True, timeout=HTTP_TIMEOUT) as resp,
+    ):
+        resp.raise_for_status()
+        with NamedTemporaryFile(dir=path.parent, delete=False) as tmp_file:
+            write_response(resp, tmp_file)
+
+    Path(tmp_file.name).replace(path)
+    return path
 
-        for row in csv_reader:
-            city_code = row[1]
-            department_code = (
-                city_code[:3] if city_code.startswith("97") else city_code[:2]
-            )
 
-            if department_code in natural_disasters_count_per_department:
-                natural_disasters_count_per_department[department_code] += 1
+class BulkDownloads:
+    """Keep big files on disk and only download and parse them again if they changed.
+
+    The server is asked whether the file changed since the last download with
+    the ETag and Last-Modified headers it gave us, so that an unchanged file
+    is neither transferred nor parsed.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def get_parsed(self, url: str, filename: str, parse: Callable[[Path], T]) -> T:
+        """Return parse(path) where path is the up to date copy of url.
+
+        The result of parse must be serializable to JSON. It is kept along with
+        the name of the parser, so that another parser doesn't get it.
+        """
+        parser = f"{parse.__qualname__}:v{PARSED_DOWNLOADS_VERSION}"
+        path = self.directory.joinpath(filename)
+        metadata_path = self.directory.joinpath(f"{filename}.json")
+
+        metadata = {}
+        if path.exists() and metadata_path.exists():
+            metadata = json.loads(metadata_path.read_text())
+
+        headers = {}
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+        with (
+            requests_cache.disabled(),
+            requests.get(
+                url,
+                headers=headers,
+                stream=True,
+                timeout=HTTP_TIMEOUT,
+            ) as resp,
+        ):
+            if resp.status_code == 304:
+                print(f"{filename} has not changed since the last download")
+                changed = False
             else:
-                natural_disasters_count_per_department[department_code] = 1
+                resp.raise_for_status()
 
-    return natural_disasters_count_per_department
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with NamedTemporaryFile(dir=self.directory, delete=False) as tmp_file:
+                    sha256 = write_response(resp, tmp_file)
 
+                Path(tmp_file.name).replace(path)
 
-def get_soil_pollution_incidents_count() -> dict[str, int]:
-    """Return how many pollution incidents happened in the given city."""
-    incidents_count_per_department = {code: 0 for code in DEPARTMENTS}
+                # Some servers don't handle conditional requests,
+                # the file is only parsed again if its content changed.
+                changed = sha256 != metadata.get("sha256")
+                if not changed:
+                    print(f"{filename} has been downloaded again but has not changed")
 
-    resp = requests.get(
-        "https://www.georisques.gouv.fr/webappReport/ws/infosols/export/excel?national=true",
-        timeout=HTTP_TIMEOUT,
-    )
-    xlsx_file = BytesIO(resp.content)
-    with warnings.catch_warnings():
-        warnings.filterwarnings(
-            "ignore",
-            category=UserWarning,
-            module=re.escape("openpyxl.styles.stylesheet"),
-        )
-        workbook = load_workbook(xlsx_file)
+                metadata.update(
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
+                    sha256=sha256,
+                )
 
-    worksheet = workbook.active
+        if changed or metadata.get("parser") != parser:
+            metadata.update(parsed=parse(path), parser=parser)
+        metadata_path.write_text(json.dumps(metadata))
 
-    if worksheet is None:
-        error = "Unable to find default worksheet"
-        raise SoilPollutionError(error)
+        return metadata["parsed"]
 
-    for row in worksheet.iter_rows(min_row=2):
-        insee_code = row[8].value
 
-        if not isinstance(insee_code, str):
-            error = f"Unexpected cell value: {insee_code}"
-            raise SoilPollutionError(error)
+def insee_department_code(insee_code: str) -> str:
+    """Return the code of the department a city belongs to, given its INSEE code."""
+    return insee_code[:3] if insee_code.startswith("97") else insee_code[:2]
 
-        department_code = (
-            insee_code[:3] if insee_code.startswith("97") else insee_code[:2]
-        )
 
-        if department_code in incidents_count_per_department:
-            incidents_count_per_department[department_code] += 1
-        else:
-            incidents_count_per_department[department_code] = 1
+# Year of the events whose date is not known.
+UNKNOWN_YEAR = 0
 
-    return incidents_count_per_department
 
+class RiskIndex:
+    """Number of risk events per commune, event type and year.
 
-def search_city(name: str, departement_name: str) -> dict[str, Any]:
-    json_content = requests_get_meteo(
-        "https://geocoding-api.open-meteo.com/v1/search",
-        params={"name": name, "count": 20, "language": "fr", "format": "json"},
-    )
+    Events are loaded once then rolled up per commune, department and year,
+    so that every query is a lookup instead of a scan of the raw database.
+    """
 
-    if "results" not in json_content:
+    def __init__(self, events: dict[tuple[str, str, int], int]) -> None:
+        self.events = events
+
+        self.insee_codes = sorted({insee_code for insee_code, _, _ in events})
+        self.event_types = sorted({event_type for _, event_type, _ in events})
+        self.years = sorted({year for _, _, year in events})
+        self.commune_index = {code: i for i, code in enumerate(self.insee_codes)}
+        self.event_type_index = {t: i for i, t in enumerate(self.event_types)}
+        self.year_index = {year: i for i, year in enumerate(self.years)}
+
+        # The department of each commune is computed once, not once per event.
+        department_of_commune = [insee_department_code(c) for c in self.insee_codes]
+        self.department_codes = sorted(set(department_of_commune))
+        self.department_index = {
+            code: i for i, code in enumerate(self.department_codes)
+        }
+        commune_department = np.array(
+            [self.department_index[code] for code in department_of_commune],
+            dtype=np.intp,
+        )
+
+        communes = np.array(
+            [self.commune_index[c] for c, _, _ in events],
+            dtype=np.intp,
+        )
+        event_types = np.array(
+            [self.event_type_index[t] for _, t, _ in events],
+            dtype=np.intp,
+        )
+        years = np.array([self.year_index[y] for _, _, y in events], dtype=np.intp)
+        counts = np.fromiter(events.values(), dtype=np.int64, count=len(events))
+
+        shape = (len(self.insee_codes), len(self.event_types), len(self.years))
+        self.per_commune_year = np.zeros((shape[0], shape[2]), dtype=np.int64)
+        np.add.at(self.per_commune_year, (communes, years), counts)
+        self.per_commune_event_type = np.zeros(shape[:2], dtype=np.int64)
+        np.add.at(self.per_commune_event_type, (communes, event_types), counts)
+        self.per_commune = self.per_commune_year.sum(axis=1)
+
+        self.per_department_event_type_year = np.zeros(
+            (len(self.department_codes), shape[1], shape[2]),
+            dtype=np.int64,
+        )
+        np.add.at(
+            self.per_department_event_type_year,
+            (commune_department[communes], event_types, years),
+            counts,
+        )
+        self.per_department = self.per_department_event_type_year.sum(axis=(1, 2))
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[str, str, int]]) -> "RiskIndex":
+        events: dict[tuple[str, str, int], int] = {}
+        for row in rows:
+            events[row] = events.get(row, 0) + 1
+
+        return cls(events)
+
+    def to_json(self) -> list[list[Any]]:
+        return [[*event, count] for event, count in self.events.items()]
+
+    @classmethod
+    def from_json(cls, value: list[list[Any]]) -> "RiskIndex":
+        return cls({(code, t, year): count for code, t, year, count in value})
+
+    def commune_count(
+        self,
+        insee_code: str,
+        event_type: str | None = None,
+        year: int | None = None,
+    ) -> int:
+        if insee_code not in self.commune_index:
+            return 0
+
+        if event_type is not None and year is not None:
+            return self.events.get((insee_code, event_type, year), 0)
+
+        commune = self.commune_index[insee_code]
+        if event_type is not None:
+            if event_type not in self.event_type_index:
+                return 0
+            event_type_index = self.event_type_index[event_type]
+            return int(self.per_commune_event_type[commune, event_type_index])
+
+        if year is not None:
+            if year not in self.year_index:
+                return 0
+            return int(self.per_commune_year[commune, self.year_index[year]])
+
+        return int(self.per_commune[commune])
+
+    def department_count(
+        self,
+        department_code: str,
+        event_type: str | None = None,
+        year: int | None = None,
+    ) -> int:
+        if department_code not in self.department_index:
+            return 0
+
+        if event_type is None and year is None:
+            return int(self.per_department[self.department_index[department_code]])
+
+        counts = self.per_department_event_type_year[
+            self.department_index[department_code]
+        ]
+        if event_type is not None:
+            if event_type not in self.event_type_index:
+                return 0
+            counts = counts[self.event_type_index[event_type]]
+        else:
+            counts = counts.sum(axis=0)
+
+        if year is not None:
+            if year not in self.year_index:
+                return 0
+            counts = counts[self.year_index[year]]
+
+        return int(counts.sum())
+
+    def count_per_year(self, department_code: str | None = None) -> dict[int, int]:
+        if department_code is None:
+            counts = self.per_department_event_type_year.sum(axis=(0, 1))
+        elif department_code in self.department_index:
+            counts = self.per_department_event_type_year[
+                self.department_index[department_code]
+            ].sum(axis=0)
+        else:
+            return {}
+
+        return dict(zip(self.years, counts.tolist(), strict=True))
+
+    def count_per_commune(self) -> dict[str, int]:
+        return dict(zip(self.insee_codes, self.per_commune.tolist(), strict=True))
+
+    def count_per_department(self) -> dict[str, int]:
+        count_per_department = {code: 0 for code in DEPARTMENTS}
+        count_per_department.update(
+            zip(self.department_codes, self.per_department.tolist(), strict=True),
+        )
+        return count_per_department
+
+
+def get_natural_disasters_index() -> RiskIndex:
+    def parse(archive: Path) -> list[list[Any]]:
+        start = perf_counter()
+        natural_disasters_index = index_natural_disasters(archive)
+        print(f"GASPAR database parsed in {perf_counter() - start:.1f} seconds")
+        return natural_disasters_index.to_json()
+
+    return RiskIndex.from_json(
+        BulkDownloads(DOWNLOADS_DIRECTORY).get_parsed(
+            "http://files.georisques.fr/GASPAR/gaspar.zip",
+            "gaspar.zip",
+            parse,
+        ),
+    )
+
+
+def get_referenced_natural_disaster_count() -> dict[str, int]:
+    return get_natural_disasters_index().count_per_department()
+
+
+def index_natural_disasters(archive: Path) -> RiskIndex:
+    def read_rows() -> Iterator[tuple[str, str, int]]:
+        # The archive is read from disk so that it doesn't have to fit in memory.
+        with ZipFile(archive) as f, f.open("catnat_gaspar.csv", "r") as csv_file:
+            next(csv_file)  # skip header
+
+            for line in csv_file:
+                # Columns are cod_nat_catnat, cod_commune, lib_commune,
+                # num_risque_jo, lib_risque_jo, dat_deb...
+                # Only the first 6 are needed, so the rest of the row isn't parsed.
+                if b'"' in line:
+                    row = next(csv.reader([line.decode()], delimiter=";"))
+                else:
+                    row = line.decode().split(";", 6)
+
+                year = re.search(r"\d{4}", row[5])
+                yield row[1], row[4], int(year[0]) if year else UNKNOWN_YEAR
+
+    return RiskIndex.from_rows(read_rows())
+
+
+def get_soil_pollution_index() -> RiskIndex:
+    return RiskIndex.from_json(
+        BulkDownloads(DOWNLOADS_DIRECTORY).get_parsed(
+            "https://www.georisques.gouv.fr/webappReport/ws/infosols/export/excel?national=true",
+            "basol.xlsx",
+            lambda xlsx_file: index_soil_pollution_incidents(xlsx_file).to_json(),
+        ),
+    )
+
+
+def get_soil_pollution_incidents_count() -> dict[str, int]:
+    """Return how many pollution incidents happened in each department."""
+    return get_soil_pollution_index().count_per_department()
+
+
+# Column of the BASOL export holding the INSEE code of the city, starting from 1.
+INSEE_CODE_COLUMN = 9
+
+# BASOL only references soil pollution incidents, without their date.
+SOIL_POLLUTION_EVENT_TYPE = "Pollution des sols"
+
+
+def index_soil_pollution_incidents(xlsx_file: Path) -> RiskIndex:
+    def read_rows() -> Iterator[tuple[str, str, int]]:
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore",
+                category=UserWarning,
+                module=re.escape("openpyxl.styles.stylesheet"),
+            )
+            # In read-only mode, rows are parsed one at a time as they're iterated
+            # instead of loading every cell and style of the workbook in memory.
+            workbook = load_workbook(xlsx_file, read_only=True)
+
+        try:
+            worksheet = workbook.active
+
+            if worksheet is None:
+                error = "Unable to find default worksheet"
+                raise SoilPollutionError(error)
+
+            # Only the INSEE code column is read.
+            for (insee_code,) in worksheet.iter_rows(
+                min_row=2,
+                min_col=INSEE_CODE_COLUMN,
+                max_col=INSEE_CODE_COLUMN,
+                values_only=True,
+            ):
+                if not isinstance(insee_code, str):
+                    error = f"Unexpected cell value: {insee_code}"
+                    raise SoilPollutionError(error)
+
+                yield insee_code, SOIL_POLLUTION_EVENT_TYPE, UNKNOWN_YEAR
+        finally:
+            # The file is kept open by the read-only mode.
+            workbook.close()
+
+    return RiskIndex.from_rows(read_rows())
+
+
+def count_soil_pollution_incidents(xlsx_file: Path) -> dict[str, int]:
+    return index_soil_pollution_incidents(xlsx_file).count_per_department()
+
+
+def search_city(name: str, departement_name: str) -> dict[str, Any]:
+    json_content = requests_get_meteo(
+        "https://geocoding-api.open-meteo.com/v1/search",
+        params={"name": name, "count": 20, "language": "fr", "format": "json"},
+    )
+
+    if "results" not in json_content:
         tokens = name.split("-")
         if len(tokens) == 1:
             error = f"No result found for '{name}'"
@@ -740,71 +1667,144 @@ def search_city(name: str, departement_name: str) -> dict[str, Any]:
     return results[0]
 
 
+def normalize_city_name(name: str) -> str:
+    """Lowercase name without accents, hyphens nor apostrophes."""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(re.split(r"[\s\-'’]+", name.lower())).strip()
+
+
+class Gazetteer:
+    """Offline index of the populated places of France, built from GeoNames dumps.
+
+    It is a drop-in replacement for search_city which sends no request once
+    the dumps have been downloaded.
+    """
+
+    def __init__(self, places: dict[tuple[str, str], dict[str, Any]]) -> None:
+        self.places = places
+        self.department_codes = {name: code for code, name in DEPARTMENTS.items()}
+
+    @classmethod
+    def load(cls, directory: Path = GAZETTEER_DIRECTORY) -> "Gazetteer":
+        places: dict[tuple[str, str], dict[str, Any]] = {}
+        # The best candidate is an administrative seat, then the most populated.
+        priorities: dict[tuple[str, str], tuple[bool, int]] = {}
+
+        for country_code, department_code in GAZETTEER_COUNTRY_CODES.items():
+            dump = download_file(
+                f"https://download.geonames.org/export/dump/{country_code}.zip",
+                directory.joinpath(f"{country_code}.zip"),
+            )
+
+            with ZipFile(dump) as zip_file, zip_file.open(f"{country_code}.txt") as f:
+                reader = csv.reader(
+                    TextIOWrapper(f, encoding="utf-8"),
+                    delimiter="\t",
+                    quoting=csv.QUOTE_NONE,
+                )
+                for row in reader:
+                    # See https://download.geonames.org/export/dump/readme.txt
+                    feature_code, elevation, dem = row[7], row[15], row[16]
+                    if not feature_code.startswith("PPL") or dem == "-9999":
+                        continue
+
+                    place = {
+                        "name": row[1],
+                        "latitude": float(row[4]),
+                        "longitude": float(row[5]),
+                        "elevation": int(elevation or dem),
+                        "population": int(row[14] or 0),
+                    }
+                    priority = (feature_code.startswith("PPLA"), place["population"])
+
+                    for name in {row[1], row[2]}:
+                        key = (department_code or row[11], normalize_city_name(name))
+                        if key not in priorities or priority > priorities[key]:
+                            places[key] = place
+                            priorities[key] = priority
+
+        return cls(places)
+
+    def search_city(self, name: str, departement_name: str) -> dict[str, Any]:
+        department_code = self.department_codes[departement_name]
+        place = self.places.get((department_code, normalize_city_name(name)))
+
+        if place is None:
+            tokens = name.split("-")
+            if len(tokens) == 1:
+                error = f"No result found for '{name}'"
+                raise CityError(error)
+            # Try to remove the city suffix as a last resort
+            return self.search_city("-".join(tokens[:1]), departement_name)
+
+        return place
+
+
 def pick_cities(
     department_name: str,
     cities_json: list[Any],
     max_elevation: int,
     sample_size: int,
+    search: Callable[[str, str], dict[str, Any]] = search_city,
 ) -> list[City]:
-    least_crowded_cities = []
-    most_crowded_cities = []
-
     sorted_cities = sorted(cities_json, key=lambda c: c["population"])
 
-    i = 0
-    for i in range(len(sorted_cities)):
+    # Cities are searched lazily, and only once even if the max elevation
+    # has to be increased.
+    resolved_cities: dict[int, City | None] = {}
+
+    def resolve_city(i: int) -> City | None:
+        if i in resolved_cities:
+            return resolved_cities[i]
+
         city_json = sorted_cities[i]
         try:
-            search_result = search_city(
+            search_result = search(
                 city_json["nom"],
                 department_name,
             )
         except CityError as ce:
-            if "No result found" in str(ce):
-                continue
-            raise
-        city = City(
-            search_result["name"],
-            search_result["latitude"],
-            search_result["longitude"],
-            search_result["elevation"],
-            city_json["population"],
-            department_name,
-        )
+            if "No result found" not in str(ce):
+                raise
+            city = None
+        else:
+            city = City(
+                search_result["name"],
+                search_result["latitude"],
+                search_result["longitude"],
+                search_result["elevation"],
+                city_json["population"],
+                department_name,
+            )
 
-        if city.elevation < max_elevation:
-            least_crowded_cities.append(city)
+        resolved_cities[i] = city
+        return city
 
-            if len(least_crowded_cities) == sample_size // 2:
-                break
+    def select_cities(max_elevation: float) -> list[City]:
+        least_crowded_cities = []
+        most_crowded_cities = []
 
-    for city_json in reversed(sorted_cities[i + 1 :]):
-        try:
-            search_result = search_city(
-                city_json["nom"],
-                department_name,
-            )
-        except CityError as ce:
-            if "No result found" in str(ce):
-                continue
-            raise
+        i = 0
+        for i in range(len(sorted_cities)):
+            city = resolve_city(i)
+            if city is not None and city.elevation < max_elevation:
+                least_crowded_cities.append(city)
 
-        city = City(
-            search_result["name"],
-            search_result["latitude"],
-            search_result["longitude"],
-            search_result["elevation"],
-            city_json["population"],
-            department_name,
-        )
+                if len(least_crowded_cities) == sample_size // 2:
+                    break
 
-        if city.elevation < max_elevation:
-            most_crowded_cities.append(city)
+        for j in reversed(range(i + 1, len(sorted_cities))):
+            city = resolve_city(j)
+            if city is not None and city.elevation < max_elevation:
+                most_crowded_cities.append(city)
 
-            if len(least_crowded_cities) + len(most_crowded_cities) == sample_size:
-                break
+                if len(least_crowded_cities) + len(most_crowded_cities) == sample_size:
+                    break
 
-    picked_cities = least_crowded_cities + most_crowded_cities
+        return least_crowded_cities + most_crowded_cities
+
+    picked_cities = select_cities(max_elevation)
 
     # Paris is an exception because it does not belong to any department,
     # it is considered to be its own department.
@@ -814,26 +1814,48 @@ def pick_cities(
         and department_name != "Paris"
         and len(sorted_cities) >= sample_size
     ):
+        # Instead of retrying with a max elevation increased by 10 meters
+        # until enough cities are found, all the elevations are known
+        # so we can directly compute the one that would have been reached.
+        elevations = sorted(
+            city.elevation
+            for city in map(resolve_city, range(len(sorted_cities)))
+            if city is not None
+        )
+
+        if not elevations:
+            error = f"No city was found for {department_name}"
+            raise CityError(error)
+
+        if len(elevations) < sample_size:
+            print(
+                f"WARNING: only {len(elevations)} cities were found for",
+                f"{department_name}, they will all be picked",
+            )
+            elevation_to_reach = elevations[-1]
+        else:
+            elevation_to_reach = elevations[sample_size - 1]
+
+        increments = max(0, math.floor((elevation_to_reach - max_elevation) / 10) + 1)
         print(
             f"WARNING: didn't find enough cities for {department_name},",
-            "will retry with an increased max elevation...",
-        )
-        return pick_cities(
-            department_name,
-            cities_json,
-            max_elevation + 10,  # increase max elevation by 10 meters
-            sample_size,
+            f"increasing max elevation to {max_elevation + increments * 10} meters",
         )
+        picked_cities = select_cities(max_elevation + increments * 10)
 
     return picked_cities
 
 
-def pick_cities_per_department(
+def pick_department_cities(
+    department_code: str,
     max_elevation: int,
-    sample_size_per_department: int = 10,
-) -> dict[str, list[City]]:
-    cities_samples = {}
-    for department_code, department_name in DEPARTMENTS.items():
+    sample_size: int,
+    checkpoints: Checkpoints | None = None,
+    search: Callable[[str, str], dict[str, Any]] = search_city,
+    geocoding: str = "api",
+) -> list[City]:
+    def download_and_pick_cities() -> list[City]:
+        department_name = DEPARTMENTS[department_code]
         print(f"Processing {department_name} (code: {department_code})...")
         cities = requests.get(
             f"https://geo.api.gouv.fr/departements/{department_code}/communes",
@@ -843,15 +1865,837 @@ def pick_cities_per_department(
         cities.raise_for_status()
         cities_json = cities.json()
         cities_json = [c for c in cities_json if "population" in c]
-        picked_cities = pick_cities(
+        return pick_cities(
             department_name,
             cities_json,
             max_elevation,
-            sample_size_per_department,
+            sample_size,
+            search,
+        )
+
+    if checkpoints is None:
+        return download_and_pick_cities()
+
+    return checkpoints.run(
+        # The cities found by the gazetteer and by the API differ.
+        f"cities:{department_code}:{max_elevation}:{sample_size}:{geocoding}",
+        download_and_pick_cities,
+        encode=lambda cities: [asdict(city) for city in cities],
+        decode=lambda value: [City(**city) for city in value],
+    )
+
+
+def get_department_communes(department_code: str) -> list[dict[str, Any]]:
+    """Return the communes of a department with their centre and surface."""
+    communes = requests.get(
+        f"https://geo.api.gouv.fr/departements/{department_code}/communes",
+        params={"fields": "nom,code,population,centre,surface"},
+        timeout=HTTP_TIMEOUT,
+    )
+    communes.raise_for_status()
+    return [c for c in communes.json() if "centre" in c and "surface" in c]
+
+
+# Size, in degrees, of the cells of the grid used instead of sampled cities.
+# 0.1 degree is about 11 km of latitude, and 8 km of longitude in France.
+GRID_RESOLUTION = 0.1
+
+
+class CommuneGrid:
+    """Cell of every commune on a regular latitude/longitude grid.
+
+    Communes are assigned to cells once, so that the data of a cell is fetched
+    once for all the communes in it, whatever the department they belong to.
+    The number of requests depends on the number of cells, not of communes.
+    """
+
+    def __init__(self, communes: list[dict[str, Any]], resolution: float) -> None:
+        self.communes = communes
+        self.resolution = resolution
+
+        coordinates = np.array(
+            [[c["latitude"], c["longitude"]] for c in communes],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+        # Row and column of the cell of each commune, cells are only created
+        # where there are communes.
+        cells, cell_of_commune = np.unique(
+            np.floor(coordinates / resolution).astype(np.int64),
+            axis=0,
+            return_inverse=True,
+        )
+        self.cells = cells
+        self.cell_of_commune = cell_of_commune.reshape(-1)
+
+    @classmethod
+    def build(
+        cls,
+        resolution: float,
+        department_codes: Iterable[str] = DEPARTMENTS,
+    ) -> "CommuneGrid":
+        communes = []
+        for department_code in department_codes:
+            print(f"Indexing the communes of {DEPARTMENTS[department_code]}")
+            communes.extend(
+                {
+                    "code": commune["code"],
+                    "department": department_code,
+                    # GeoJSON points are longitude first.
+                    "latitude": commune["centre"]["coordinates"][1],
+                    "longitude": commune["centre"]["coordinates"][0],
+                    "population": commune.get("population", 0),
+                }
+                for commune in get_department_communes(department_code)
+            )
+
+        return cls(communes, resolution)
+
+    def to_json(self) -> dict[str, Any]:
+        return {"resolution": self.resolution, "communes": self.communes}
+
+    @classmethod
+    def from_json(cls, value: dict[str, Any]) -> "CommuneGrid":
+        return cls(value["communes"], value["resolution"])
+
+    def cell_centre(self, cell: int) -> tuple[float, float]:
+        row, column = self.cells[cell].tolist()
+        # Rounded so that the store finds the cell again whatever the run.
+        return (
+            round((row + 0.5) * self.resolution, 6),
+            round((column + 0.5) * self.resolution, 6),
+        )
+
+    def cells_per_department(self) -> dict[str, list[City]]:
+        """Return the cells overlapping each department, as cities.
+
+        The population of a cell is the one of the communes of the department
+        in it, a cell across a border is shared by several departments.
+        """
+        departments = np.array([c["department"] for c in self.communes])
+        populations = np.array(
+            [c["population"] for c in self.communes],
+            dtype=np.int64,
+        )
+
+        cells_per_department = {}
+        for department_code in DEPARTMENTS:
+            in_department = departments == department_code
+            department_cells = self.cell_of_commune[in_department]
+            cells = np.unique(department_cells)
+            population_per_cell = np.bincount(
+                np.searchsorted(cells, department_cells),
+                populations[in_department],
+                minlength=len(cells),
+            )
+
+            department_name = DEPARTMENTS[department_code]
+            cells_per_department[department_code] = [
+                City(
+                    f"cell {latitude}, {longitude}",
+                    latitude,
+                    longitude,
+                    # Open-Meteo uses the elevation of its own model.
+                    0,
+                    int(population),
+                    department_name,
+                )
+                for (latitude, longitude), population in zip(
+                    map(self.cell_centre, cells.tolist()),
+                    population_per_cell.tolist(),
+                    strict=True,
+                )
+            ]
+
+        return cells_per_department
+
+
+def run_in(executor: Executor | None, function: Callable[..., T], *args: Any) -> T:
+    """Call the function in the executor, or in the calling thread without one."""
+    if executor is None:
+        return function(*args)
+    return executor.submit(function, *args).result()
+
+
+def compute_average_season_weather_of_batch(
+    cities: list[City],
+    content: bytes,
+) -> dict[City, tuple[Weather, Weather]]:
+    weather_per_city = parse_weather_batch(cities, content)
+    return dict(
+        zip(
+            weather_per_city,
+            compute_average_season_weather_batch(list(weather_per_city.values())),
+            strict=True,
+        ),
+    )
+
+
+def fetch_average_season_weather(
+    cities: list[City],
+    executor: Executor | None = None,
+) -> dict[City, tuple[Weather, Weather]]:
+    """Fetch the weather of the cities, then decode and aggregate it in executor.
+
+    The thread sending the request only waits for the executor, so that the
+    responses of the other threads can be processed in parallel.
+    """
+    for city in cities:
+        print(f"Processing weather of {city.name} in {city.departement}")
+    content = request_weather_batch(cities, date(1994, 1, 1), date(2023, 12, 31))
+    return run_in(executor, compute_average_season_weather_of_batch, cities, content)
+
+
+def fetch_air_quality_mean(
+    cities: list[City],
+    executor: Executor | None = None,
+) -> dict[City, AirQuality]:
+    """Same as fetch_average_season_weather, for the air quality."""
+    for city in cities:
+        print(f"Processing air quality of {city.name} in {city.departement}")
+    content = request_air_quality_batch(cities, date(2022, 7, 29), date(2024, 7, 7))
+    return run_in(executor, compute_air_quality_mean_batch, cities, content)
+
+
+# Keys of the per-city aggregates in the result store.
+WEATHER_DATASET = (
+    f"weather:1994-01-01:2023-12-31:{','.join(WEATHER_DAILY_VARIABLES)}"
+    f":v{RESULT_STORE_VERSION}"
+)
+AIR_QUALITY_DATASET = (
+    f"air_quality:2022-07-29:2024-07-07:{','.join(f.name for f in fields(AirQuality))}"
+    f":v{RESULT_STORE_VERSION}"
+)
+
+
+@dataclass(frozen=True)
+class DepartmentData:
+    cities: list[City]
+    average_season_weather_per_city: dict[City, tuple[Weather, Weather]]
+    air_quality_per_city: dict[City, AirQuality]
+
+
+def fetch_average_season_weather_stored(
+    store: ResultStore,
+    cities: list[City],
+    executor: Executor | None = None,
+) -> dict[City, tuple[Weather, Weather]]:
+    return fetch_per_city_stored(
+        store,
+        WEATHER_DATASET,
+        lambda batch: fetch_average_season_weather(batch, executor),
+        cities,
+        encode=lambda season_weather: [asdict(w) for w in season_weather],
+        decode=lambda value: (Weather(**value[0]), Weather(**value[1])),
+    )
+
+
+def fetch_air_quality_mean_stored(
+    store: ResultStore,
+    cities: list[City],
+    executor: Executor | None = None,
+) -> dict[City, AirQuality]:
+    return fetch_per_city_stored(
+        store,
+        AIR_QUALITY_DATASET,
+        lambda batch: fetch_air_quality_mean(batch, executor),
+        cities,
+        encode=asdict,
+        decode=lambda value: AirQuality(**value),
+    )
+
+
+def get_search_function(geocoding: str) -> Callable[[str, str], dict[str, Any]]:
+    if geocoding == "gazetteer":
+        return Gazetteer.load().search_city
+    return search_city
+
+
+def reopen_http_cache() -> None:
+    """Give a worker process its own connection to the HTTP cache.
+
+    A SQLite connection must not be used across a fork, like the one opened by
+    the parent process when the module was imported.
+    """
+    requests_cache.uninstall_cache()
+    requests_cache.install_cache(HTTP_CACHE_NAME)
+
+
+# What each worker process needs to call pick_department_cities,
+# it is set up by init_department_worker.
+department_worker_arguments: dict[str, Any] = {}
+
+
+def init_department_worker(
+    search: Callable[[str, str], dict[str, Any]],
+    geocoding: str,
+    max_elevation: int,
+    sample_size: int,
+    workers_count: int,
+) -> None:
+    reopen_http_cache()
+    METEO_RATE_LIMITER.split(workers_count)
+    department_worker_arguments.update(
+        max_elevation=max_elevation,
+        sample_size=sample_size,
+        # The checkpoints have already been reset by the parent process if needed.
+        checkpoints=Checkpoints(RESULT_STORE_PATH, resume=True),
+        search=search,
+        geocoding=geocoding,
+    )
+
+
+def pick_department_cities_in_worker(department_code: str) -> list[City]:
+    return pick_department_cities(department_code, **department_worker_arguments)
+
+
+def fetch_departments_data(
+    store: ResultStore,
+    cities_per_department: dict[str, list[City]],
+    executor: Executor | None = None,
+) -> dict[str, DepartmentData]:
+    """Fetch and aggregate the data of the cities of all the departments at once.
+
+    The requests are sent concurrently by the threads of fetch_per_city, the
+    responses are decoded and aggregated in the executor if there is one.
+    Places shared by several departments, like the cells of a grid, are only
+    fetched once.
+    """
+    places = {
+        (city.latitude, city.longitude): city
+        for cities in cities_per_department.values()
+        for city in cities
+    }
+    average_season_weather_per_place = {
+        (city.latitude, city.longitude): season_weather
+        for city, season_weather in fetch_average_season_weather_stored(
+            store,
+            list(places.values()),
+            executor,
+        ).items()
+    }
+    air_quality_per_place = {
+        (city.latitude, city.longitude): air_quality
+        for city, air_quality in fetch_air_quality_mean_stored(
+            store,
+            list(places.values()),
+            executor,
+        ).items()
+    }
+
+    return {
+        department_code: DepartmentData(
+            cities,
+            {
+                city: average_season_weather_per_place[(city.latitude, city.longitude)]
+                for city in cities
+            },
+            {
+                city: air_quality_per_place[(city.latitude, city.longitude)]
+                for city in cities
+            },
+        )
+        for department_code, cities in cities_per_department.items()
+    }
+
+
+def process_departments(
+    store: ResultStore,
+    checkpoints: Checkpoints,
+    geocoding: str,
+    workers_count: int = 1,
+    max_elevation: int = 400,
+    sample_size: int = 10,
+) -> dict[str, DepartmentData]:
+    """Pick the cities of every department then fetch and aggregate their data.
+
+    With several workers, cities are picked in worker processes, which then
+    decode and aggregate the responses fetched by the threads of this process.
+
+    Results are always returned in the order of DEPARTMENTS so that the maps
+    are the same whatever the number of workers.
+    """
+    # The gazetteer is downloaded and loaded once, the workers only read it.
+    search = get_search_function(geocoding)
+
+    if workers_count == 1:
+        cities_per_department = {
+            department_code: pick_department_cities(
+                department_code,
+                max_elevation,
+                sample_size,
+                checkpoints,
+                search,
+                geocoding,
+            )
+            for department_code in DEPARTMENTS
+        }
+        return fetch_departments_data(store, cities_per_department)
+
+    with ProcessPoolExecutor(
+        max_workers=workers_count,
+        initializer=init_department_worker,
+        initargs=(search, geocoding, max_elevation, sample_size, workers_count),
+    ) as executor:
+        cities_per_department = dict(
+            zip(
+                DEPARTMENTS,
+                executor.map(pick_department_cities_in_worker, DEPARTMENTS),
+                strict=True,
+            ),
+        )
+        return fetch_departments_data(store, cities_per_department, executor)
+
+
+def process_departments_gridded(
+    store: ResultStore,
+    grid: CommuneGrid,
+    workers_count: int = 1,
+) -> dict[str, DepartmentData]:
+    """Fetch the data of every cell of the grid, then split it per department.
+
+    The responses are decoded and aggregated in worker processes if requested.
+    """
+    print(
+        f"{len(grid.communes)} communes in {len(grid.cells)} cells "
+        f"of {grid.resolution} degrees",
+    )
+
+    if workers_count == 1:
+        return fetch_departments_data(store, grid.cells_per_department())
+
+    with ProcessPoolExecutor(
+        max_workers=workers_count,
+        initializer=reopen_http_cache,
+    ) as executor:
+        return fetch_departments_data(store, grid.cells_per_department(), executor)
+
+
+SVG_NAMESPACE = "http://www.w3.org/2000/svg"
+XLINK_NAMESPACE = "http://www.w3.org/1999/xlink"
+
+# File next to the maps holding the department paths they all share.
+SHARED_GEOMETRY_FILENAME = "carte_departements.svg"
+
+
+# How far, in pixels of the rendered map, simplified paths can be from the
+# original ones. The department paths have a lot more detail than what a map
+# displayed 800 pixels wide can show.
+MAP_SIMPLIFICATION_TOLERANCE = 0.5
+
+SVG_PATH_TOKEN = re.compile(
+    r"[MmLlCcHhVvZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?",
+)
+
+
+def parse_svg_path(d: str, flatness: float) -> list[np.ndarray]:
+    """Return the rings of an SVG path as arrays of absolute points.
+
+    Curves are approximated by straight segments which are at most ``flatness``
+    away from them.
+    """
+    tokens = SVG_PATH_TOKEN.findall(d)
+    rings: list[list[tuple[float, float]]] = []
+    position = start = (0.0, 0.0)
+    command = ""
+    i = 0
+
+    def read_numbers(count: int) -> list[float]:
+        nonlocal i
+        numbers = [float(token) for token in tokens[i : i + count]]
+        i += count
+        return numbers
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+        elif command in {"M", "m"}:
+            # Coordinates following a move are implicit line-tos.
+            command = "L" if command == "M" else "l"
+
+        relative = command.islower()
+        origin = position if relative else (0.0, 0.0)
+
+        if command in {"Z", "z"}:
+            position = start
+            continue
+
+        if command in {"M", "m"}:
+            x, y = read_numbers(2)
+            position = start = (origin[0] + x, origin[1] + y)
+            rings.append([position])
+        elif command in {"L", "l"}:
+            x, y = read_numbers(2)
+            position = (origin[0] + x, origin[1] + y)
+            rings[-1].append(position)
+        elif command in {"H", "h"}:
+            (x,) = read_numbers(1)
+            position = (origin[0] + x, position[1])
+            rings[-1].append(position)
+        elif command in {"V", "v"}:
+            (y,) = read_numbers(1)
+            position = (position[0], origin[1] + y)
+            rings[-1].append(position)
+        elif command in {"C", "c"}:
+            x1, y1, x2, y2, x, y = read_numbers(6)
+            control_points = np.array(
+                [
+                    position,
+                    (origin[0] + x1, origin[1] + y1),
+                    (origin[0] + x2, origin[1] + y2),
+                    (origin[0] + x, origin[1] + y),
+                ],
+            )
+            # The distance between a curve and a polyline of n segments is at most
+            # 1/8 of the bound of its second derivative divided by n^2.
+            second_derivative_bound = 6 * max(
+                math.hypot(*(control_points[i] - 2 * control_points[i + 1] + p))
+                for i, p in enumerate(control_points[2:])
+            )
+            segments_count = max(
+                1,
+                math.ceil(math.sqrt(second_derivative_bound / (8 * flatness))),
+            )
+            t = np.linspace(0, 1, segments_count + 1)[1:, np.newaxis]
+            # Bernstein form of the cubic Bézier curve.
+            coefficients = np.hstack(
+                [(1 - t) ** 3, 3 * (1 - t) ** 2 * t, 3 * (1 - t) * t**2, t**3],
+            )
+            rings[-1] += [tuple(p) for p in coefficients @ control_points]
+            position = rings[-1][-1]
+        else:
+            error = f"Unsupported SVG path command: {command}"
+            raise MapError(error)
+
+    return [np.array(ring) for ring in rings]
+
+
+def simplify_polyline(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplify a polyline with the Douglas-Peucker algorithm."""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        segment = points[last] - points[first]
+        offsets = points[first + 1 : last] - points[first]
+        length = math.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            cross = offsets[:, 0] * segment[1] - offsets[:, 1] * segment[0]
+            distances = np.abs(cross) / length
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            farthest += first + 1
+            keep[farthest] = True
+            stack += [(first, farthest), (farthest, last)]
+
+    return points[keep]
+
+
+def format_svg_path(rings: list[np.ndarray], decimals: int) -> str:
+    """Return the SVG path of closed rings, with relative coordinates."""
+    d = []
+    position = np.zeros(2)
+    for ring in rings:
+        # Absolute coordinates are rounded before computing the relative ones,
+        # so that rounding errors don't add up along the path.
+        rounded_ring = np.round(ring, decimals)
+        deltas = np.diff(np.vstack([position, rounded_ring]), axis=0)
+        position = rounded_ring[0]
+
+        # Adding 0 turns negative zeros into zeros, which are shorter to write.
+        numbers = [
+            f"{x:.{decimals}f},{y:.{decimals}f}"
+            for x, y in np.round(deltas, decimals) + 0.0
+        ]
+        d.append(f"m{numbers[0]} {' '.join(numbers[1:])}z")
+
+    return "".join(d)
+
+
+def optimize_map(svg: bytes, tolerance: float) -> bytes:
+    """Simplify the department paths of a map and strip its whitespace.
+
+    The tolerance is the maximum distance, in pixels of the rendered map,
+    between the simplified paths and the original ones, rounding of the
+    coordinates included.
+    """
+    root = ElementTree.fromstring(svg)
+
+    for element in root.iter():
+        # Indentation between elements doesn't change the rendering.
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+
+    for departments_svg in root.iter(f"{{{SVG_NAMESPACE}}}svg"):
+        if departments_svg is root:
+            continue
+
+        # Paths are expressed in the units of the view box of the departments.
+        view_box_width = float(departments_svg.get("viewBox", "").split()[2])
+        path_tolerance = (
+            tolerance * view_box_width / float(departments_svg.get("width"))
         )
-        cities_samples[department_code] = picked_cities
+        # Rounding moves the points by up to half a unit of the last decimal
+        # along both axes, the decimals are chosen so that it's at most
+        # half of the tolerance.
+        decimals = max(0, math.ceil(math.log10(math.sqrt(2) / path_tolerance)))
+        rounding_error = math.sqrt(2) / 2 * 10**-decimals
+        # Half of the rest goes to the approximation of the curves, the other
+        # half to the simplification.
+        curve_tolerance = (path_tolerance - rounding_error) / 2
+
+        for path in departments_svg.iter(f"{{{SVG_NAMESPACE}}}path"):
+            rings = []
+            for ring in parse_svg_path(path.get("d", ""), curve_tolerance):
+                # The ring is closed so that its last segment is simplified too.
+                closed_ring = np.vstack([ring, ring[:1]])
+                simplified_ring = simplify_polyline(
+                    closed_ring,
+                    curve_tolerance,
+                )[:-1]
+                # Rings smaller than the tolerance would not be visible.
+                if len(simplified_ring) >= 3:
+                    rings.append(simplified_ring)
+
+            path.set("d", format_svg_path(rings, decimals))
+            path.set("class", path.get("class", "").strip())
+
+    return ElementTree.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+def split_map_geometry(svg: bytes, geometry_href: str) -> tuple[bytes, bytes]:
+    """Move the department paths of a map to a separate SVG document.
+
+    Return the map, where each path is replaced by a reference to the separate
+    document, and that document. The department paths are the same for every map,
+    so they are downloaded once per page instead of once per map.
+    """
+    root = ElementTree.fromstring(svg)
+    geometry = ElementTree.Element(f"{{{SVG_NAMESPACE}}}svg")
+    geometry_defs = ElementTree.SubElement(geometry, f"{{{SVG_NAMESPACE}}}defs")
+
+    ids_count: dict[str, int] = {}
+    for group in root.iter(f"{{{SVG_NAMESPACE}}}g"):
+        classes = group.get("class", "").split()
+        if "departement" not in classes:
+            continue
+
+        for path in group:
+            if path.tag != f"{{{SVG_NAMESPACE}}}path":
+                continue
+
+            # Some departments are drawn more than once, ids have to be unique.
+            department_class = classes[0]
+            count = ids_count.get(department_class, 0)
+            ids_count[department_class] = count + 1
+            path_id = department_class if count == 0 else f"{department_class}-{count}"
+
+            ElementTree.SubElement(
+                geometry_defs,
+                f"{{{SVG_NAMESPACE}}}path",
+                id=path_id,
+                d=path.attrib.pop("d"),
+            )
+
+            # The reference keeps the classes of the path,
+            # which the tooltips rely on.
+            path.tag = f"{{{SVG_NAMESPACE}}}use"
+            path.set(f"{{{XLINK_NAMESPACE}}}href", f"{geometry_href}#{path_id}")
+
+    return (
+        ElementTree.tostring(root, encoding="utf-8", xml_declaration=True),
+        ElementTree.tostring(geometry, encoding="utf-8", xml_declaration=True),
+    )
+
+
+def write_if_changed(path: Path, content: bytes) -> None:
+    """Write the file unless it already has this content."""
+    if path.exists() and path.read_bytes() == content:
+        return
+
+    with NamedTemporaryFile(dir=path.parent, delete=False) as tmp_file:
+        tmp_file.write(content)
+    # Temporary files are only readable by their owner,
+    # the published file must be readable like the maps.
+    Path(tmp_file.name).chmod(0o644)
+
+    # Maps rendered in parallel share the same geometry file,
+    # it's replaced at once so that it's never read half written.
+    Path(tmp_file.name).replace(path)
+
+
+def jenks_breaks(values: np.ndarray, n_classes: int) -> list[float]:
+    """Return the exact Jenks natural breaks of the values.
+
+    This is the Fisher-Jenks dynamic programming, which minimizes the sum of
+    squared deviations within classes. Because the optimal start of the last class
+    never decreases when the end of the data grows, each class count is solved by
+    divide and conquer in O(n log n) instead of O(n^2), one level of recursion at
+    a time so that every level is a handful of array operations.
+    """
+    x = np.sort(values)
+    n = len(x)
+    sums = np.concatenate([[0], np.cumsum(x)])
+    squares_sums = np.concatenate([[0], np.cumsum(x * x)])
+
+    def deviation(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Return the sum of squared deviations of x[starts:ends]."""
+        segment_sums = sums[ends] - sums[starts]
+        return (
+            squares_sums[ends]
+            - squares_sums[starts]
+            - segment_sums**2 / (ends - starts)
+        )
+
+    # costs[b] is the lowest deviation of x[:b] split into the current class count.
+    ends = np.arange(1, n + 1)
+    costs = np.full(n + 1, np.inf)
+    costs[1:] = deviation(np.zeros(n, dtype=np.intp), ends)
+    class_starts = np.zeros((n_classes + 1, n + 1), dtype=np.intp)
+
+    for class_count in range(2, n_classes + 1):
+        new_costs = np.full(n + 1, np.inf)
+        # Each task solves the ends in [low, high] knowing that their optimal
+        # start is in [first_start, last_start].
+        tasks = np.array([[class_count, n, class_count - 1, n - 1]], dtype=np.intp)
+
+        while len(tasks):
+            low, high, first_start, last_start = tasks.T
+            middles = (low + high) // 2
+            last_candidates = np.minimum(last_start, middles - 1)
+            counts = last_candidates - first_start + 1
+
+            offsets = np.repeat(np.cumsum(counts) - counts, counts)
+            task_of_candidate = np.repeat(np.arange(len(tasks)), counts)
+            candidate_starts = (
+                np.arange(counts.sum()) - offsets + first_start[task_of_candidate]
+            )
+            candidate_ends = middles[task_of_candidate]
+            candidate_costs = costs[candidate_starts] + deviation(
+                candidate_starts,
+                candidate_ends,
+            )
+
+            segment_starts = np.cumsum(counts) - counts
+            best_costs = np.minimum.reduceat(candidate_costs, segment_starts)
+            is_best = candidate_costs == np.repeat(best_costs, counts)
+            best_indices = np.flatnonzero(is_best)
+            best_indices = best_indices[np.searchsorted(best_indices, segment_starts)]
+            best_starts = candidate_starts[best_indices]
+
+            new_costs[middles] = best_costs
+            class_starts[class_count, middles] = best_starts
+
+            tasks = np.concatenate(
+                [
+                    np.column_stack([low, middles - 1, first_start, best_starts]),
+                    np.column_stack([middles + 1, high, best_starts, last_start]),
+                ],
+            )
+            tasks = tasks[tasks[:, 0] <= tasks[:, 1]]
+
+        costs = new_costs
 
-    return cities_samples
+    breaks = [float(x[-1])]
+    end = n
+    for class_count in range(n_classes, 1, -1):
+        end = class_starts[class_count, end]
+        breaks.append(float(x[end - 1]))
+    breaks.append(float(x[0]))
+
+    return breaks[::-1]
+
+
+def quantile_breaks(values: np.ndarray, n_classes: int) -> list[float]:
+    """Return breaks putting the same number of values in each class."""
+    return np.quantile(values, np.linspace(0, 1, n_classes + 1)).tolist()
+
+
+def equal_interval_breaks(values: np.ndarray, n_classes: int) -> list[float]:
+    """Return breaks splitting the range of the values in classes of equal size."""
+    return np.linspace(values.min(), values.max(), n_classes + 1).tolist()
+
+
+def head_tail_breaks(values: np.ndarray, n_classes: int) -> list[float]:
+    """Return the head/tail breaks of the values, for heavy-tailed distributions.
+
+    The values are split around their mean, then the head (the values above the
+    mean) is split again as long as it is a minority. There can be fewer classes
+    than requested.
+    """
+    breaks = [float(values.min())]
+    head = values
+    while len(breaks) < n_classes:
+        head_mean = head.mean()
+        new_head = head[head > head_mean]
+        # The head must stay a minority of the values for the scheme to make sense.
+        if not len(new_head) or len(new_head) / len(head) > 0.4:
+            break
+        breaks.append(float(head_mean))
+        head = new_head
+
+    return [*breaks, float(values.max())]
+
+
+CLASSIFICATION_SCHEMES: dict[str, Callable[[np.ndarray, int], list[float]]] = {
+    "jenks": jenks_breaks,
+    "quantiles": quantile_breaks,
+    "equal_interval": equal_interval_breaks,
+    "head_tail": head_tail_breaks,
+}
+
+# Breaks already computed, keyed by scheme, hash of the values and class count.
+classification_cache: dict[tuple[str, str, int], list[float]] = {}
+
+
+def classify(
+    values: Iterable[float],
+    n_classes: int,
+    scheme: str = "jenks",
+) -> list[float]:
+    """Return the breaks of the values: the minimum then the maximum of each class.
+
+    The breaks of the same values are only computed once.
+    """
+    array = np.fromiter(values, dtype=np.float64)
+    unique_values_count = len(np.unique(array))
+    if n_classes < 1 or n_classes > unique_values_count:
+        error = (
+            f"Cannot split {unique_values_count} distinct values "
+            f"into {n_classes} classes"
+        )
+        raise MapError(error)
+
+    key = (scheme, hashlib.sha256(array.tobytes()).hexdigest(), n_classes)
+    if key not in classification_cache:
+        classification_cache[key] = CLASSIFICATION_SCHEMES[scheme](array, n_classes)
+
+    return classification_cache[key]
+
+
+def assign_classes(values: Any, breaks: list[float]) -> np.ndarray:
+    """Return the index of the class of each value, given the breaks of classify().
+
+    Values below the first class or above the last one are put in them.
+    The values can be an array of any shape, for instance one row per indicator
+    to rank several indicators against the same breaks at once.
+    """
+    # A value equal to a break belongs to the class the break ends.
+    return np.searchsorted(
+        np.asarray(breaks[1:-1]),
+        np.asarray(values, dtype=np.float64),
+        side="left",
+    )
 
 
 def build_plot(
@@ -860,6 +2704,10 @@ def build_plot(
     values_per_department: dict[str, Any],
     categories: list[tuple[str, str]],
     style: Style | None = None,
+    *,
+    shared_geometry: bool = True,
+    simplification_tolerance: float = MAP_SIMPLIFICATION_TOLERANCE,
+    classification_scheme: str = "jenks",
 ) -> None:
     # Exclude DOM-TOMs from the Jenks classification
     # because there are way too different.
@@ -868,29 +2716,20 @@ def build_plot(
     values_per_department_without_dom_toms = {
         k: v for k, v in values_per_department.items() if len(k) < 3
     }
-    classes = jenks_breaks(
-        list(values_per_department_without_dom_toms.values()),
-        n_classes=len(categories),
+    classes = classify(
+        values_per_department_without_dom_toms.values(),
+        len(categories),
+        classification_scheme,
     )
-    clusters = [{} for _ in range(len(categories))]
-
-    for k, v in values_per_department.items():
-        for i in range(len(categories)):
-            if v <= classes[i + 1]:
-                clusters[i][k] = v
-                break
+    clusters: list[dict[str, Any]] = [{} for _ in range(len(categories))]
 
-    values_per_dom_toms = {
-        k: v for k, v in values_per_department.items() if len(k) == 3
-    }
-
-    for k, v in values_per_dom_toms.items():
-        for i in range(len(categories)):
-            if v <= classes[i + 1]:
-                clusters[i][k] = v
-                break
-        else:
-            clusters[-1][k] = v
+    # DOM-TOMs below the first class or above the last one are put in them.
+    for (k, v), i in zip(
+        values_per_department.items(),
+        assign_classes(list(values_per_department.values()), classes),
+        strict=True,
+    ):
+        clusters[i][k] = v
 
     colors = [t[1] for t in categories]
 
@@ -931,6 +2770,9 @@ def build_plot(
         margin=0,
         show_legend=False,
     )
+    # The chart id is random by default, it is fixed so that rendering
+    # the same data twice gives the same file.
+    france_map.uuid = str(uuid5(NAMESPACE_URL, output_file.name))
 
     for i, cluster in enumerate(clusters):
         france_map.add(
@@ -938,455 +2780,855 @@ def build_plot(
             [{"value": (k, v), "color": colors[i]} for k, v in cluster.items()],
         )
 
-    with output_file.open("w") as map_file:
-        map_file.write(france_map.render().decode())
+    rendered_svg = svg = france_map.render()
 
+    if simplification_tolerance > 0:
+        svg = optimize_map(svg, simplification_tolerance)
 
-def main() -> None:
-    cities_per_department = pick_cities_per_department(
-        max_elevation=400,
-        sample_size_per_department=10,
-    )
+    size = len(svg)
+    if shared_geometry:
+        svg, geometry = split_map_geometry(svg, SHARED_GEOMETRY_FILENAME)
+        write_if_changed(output_file.with_name(SHARED_GEOMETRY_FILENAME), geometry)
+        size = len(svg)
 
-    average_winter_weather_per_city: dict[City, Weather] = {}
-    average_summer_weather_per_city: dict[City, Weather] = {}
+    with output_file.open("w") as map_file:
+        map_file.write(svg.decode())
 
-    for cities in cities_per_department.values():
-        for city in cities:
-            print(f"Processing weather of {city.name} in {city.departement}")
-            weather = get_weather(city, date(1994, 1, 1), date(2023, 12, 31))
-            city_winter_mean, city_summer_mean = compute_average_season_weather(weather)
-            average_winter_weather_per_city[city] = city_winter_mean
-            average_summer_weather_per_city[city] = city_summer_mean
+    print(
+        f"{output_file.name}: {len(rendered_svg) / 1024:.0f} KiB rendered, "
+        f"{size / 1024:.0f} KiB written "
+        f"({1 - size / len(rendered_svg):.0%} saved)",
+    )
 
-    average_winter_weather_per_department: dict[str, Weather] = {}
-    average_summer_weather_per_department: dict[str, Weather] = {}
 
-    for department, cities in cities_per_department.items():
-        all_cities_winter_weather = []
-        all_cities_summer_weather = []
+class RenderedMaps:
+    """Hashes of the inputs of the maps and of the files they were rendered to.
 
-        for city in cities:
-            all_cities_winter_weather.append(average_winter_weather_per_city[city])
-            all_cities_summer_weather.append(average_summer_weather_per_city[city])
+    A map whose inputs didn't change since it was rendered isn't rendered again,
+    unless its file has been modified in the meantime.
+    """
 
-        average_department_winter_weather = compute_average_weather(
-            all_cities_winter_weather,
-        )
-        average_department_summer_weather = compute_average_weather(
-            all_cities_summer_weather,
-        )
-        average_winter_weather_per_department[department] = (
-            average_department_winter_weather
-        )
-        average_summer_weather_per_department[department] = (
-            average_department_summer_weather
+    def __init__(self, path: Path) -> None:
+        self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS maps (
+                    filename TEXT PRIMARY KEY,
+                    inputs_hash TEXT NOT NULL,
+                    output_hash TEXT NOT NULL
+                )
+                """,
+            )
+
+    def is_up_to_date(self, output_file: Path, inputs_hash: str) -> bool:
+        row = self.connection.execute(
+            "SELECT inputs_hash, output_hash FROM maps WHERE filename = ?",
+            (output_file.name,),
+        ).fetchone()
+
+        return (
+            row is not None
+            and row[0] == inputs_hash
+            and output_file.exists()
+            and row[1] == hashlib.sha256(output_file.read_bytes()).hexdigest()
         )
 
-    mean_air_quality_per_department: dict[str, float] = {}
-    max_air_quality_per_department: dict[str, float] = {}
-
-    for department_code, cities in cities_per_department.items():
-        department_air_quality: list[AirQuality] = []
-        for city in cities:
-            print(f"Processing air quality of {city.name} in {city.departement}")
-            air_quality_mean = get_air_quality_mean(
-                city,
-                date(2022, 7, 29),
-                date(2024, 7, 7),
+    def put(self, output_file: Path, inputs_hash: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO maps VALUES (?, ?, ?)",
+                (
+                    output_file.name,
+                    inputs_hash,
+                    hashlib.sha256(output_file.read_bytes()).hexdigest(),
+                ),
             )
-            department_air_quality.append(air_quality_mean)
 
-        mean_air_quality_per_department[department_code] = mean(
-            [aq.european_aqi_mean for aq in department_air_quality],
-        )
-        max_air_quality_per_department[department_code] = mean(
-            [aq.european_aqi_max for aq in department_air_quality],
-        )
 
-    print("Processing soil pollution incidents count per department...")
-    soil_pollution_incidents_count_per_department: dict[str, int] = (
-        get_soil_pollution_incidents_count()
-    )
+QUALITY_CATEGORIES = (
+    ("Très bon", "#43A047"),
+    ("Bon", "#C0CA33"),
+    ("Moyen", "#FDD835"),
+    ("Mauvais", "#FB8C00"),
+    ("Très mauvais", "#E53935"),
+)
+HOT_TEMPERATURE_CATEGORIES = (
+    ("Le plus froid", "#FFCDD2"),  # 100
+    ("Plutôt froid", "#EF9A9A"),  # 200
+    ("Tempéré", "#EF5350"),  # 400
+    ("Plutôt chaud", "#E53935"),  # 600
+    ("Le plus chaud", "#C62828"),  # 800
+)
+COLD_TEMPERATURE_CATEGORIES = (
+    ("Le plus froid", "#1565C0"),  # 800
+    ("Plutôt froid", "#1E88E5"),  # 600
+    ("Tempéré", "#42A5F5"),  # 400
+    ("Plutôt chaud", "#90CAF9"),  # 200
+    ("Le plus chaud", "#BBDEFB"),  # 100
+)
+SUN_CATEGORIES = (
+    ("Très faible", "#FFF9C4"),  # 100
+    ("Faible", "#FFF59D"),  # 200
+    ("Moyen", "#FFEE58"),  # 400
+    ("Important", "#FDD835"),  # 600
+    ("Très important", "#F9A825"),  # 800
+)
+WIND_CATEGORIES = (
+    ("Très faible", "#B2DFDB"),  # 100
+    ("Faible", "#80CBC4"),  # 200
+    ("Moyen", "#26A69A"),  # 400
+    ("Important", "#00897B"),  # 600
+    ("Très important", "#00695C"),  # 800
+)
+RAIN_CATEGORIES = (
+    ("Très faible", "#BBDEFB"),  # 100
+    ("Faible", "#90CAF9"),  # 200
+    ("Moyenne", "#42A5F5"),  # 400
+    ("Importante", "#1E88E5"),  # 600
+    ("Très importante", "#1565C0"),  # 800
+)
+SNOW_CATEGORIES = (
+    ("Très faibles", "#B2EBF2"),  # 100
+    ("Faibles", "#80DEEA"),  # 200
+    ("Moyennes", "#26C6DA"),  # 400
+    ("Importantes", "#00ACC1"),  # 600
+    ("Très importantes", "#00838F"),  # 800
+)
+RISK_CATEGORIES = (
+    ("Très faible", "#43A047"),
+    ("Faible", "#C0CA33"),
+    ("Moyen", "#FDD835"),
+    ("Important", "#FB8C00"),
+    ("Très important", "#E53935"),
+)
+
+
+def rainfall_evapotranspiration_ratio(weather: Weather) -> float:
+    return weather.rainfall_sum / weather.et0_fao_evapotranspiration
 
-    print("Processing natural disasters count per department...")
-    natural_disasters_count_per_department: dict[str, int] = (
-        get_referenced_natural_disaster_count()
-    )
 
-    print("Building maps...")
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath("../_static/images/carte_qualite_de_lair.svg"),
-        "Indice moyen de qualité de l'air (2022 - 2024)",
-        mean_air_quality_per_department,
-        [
-            ("Très bon", "#43A047"),
-            ("Bon", "#C0CA33"),
-            ("Moyen", "#FDD835"),
-            ("Mauvais", "#FB8C00"),
-            ("Très mauvais", "#E53935"),
-        ],
-    )
+@dataclass(frozen=True)
+class MapSpec:
+    """Description of a map of the 'choix de la région' page."""
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_pics_de_pollution_de_lair.svg",
-        ),
-        "Pics de pollution de l'air (2022 - 2024)",
-        max_air_quality_per_department,
-        [
-            ("Très bon", "#43A047"),
-            ("Bon", "#C0CA33"),
-            ("Moyen", "#FDD835"),
-            ("Mauvais", "#FB8C00"),
-            ("Très mauvais", "#E53935"),
-        ],
-    )
+    filename: str
+    title: str
+    # Name of the per-department values the map is built from, see main().
+    source: str
+    categories: tuple[tuple[str, str], ...]
+    # Extracts the value to display from the value of a department in the source.
+    value: Callable[[Any], float] | None = None
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_ratio_precipitations_evapotranspiration.svg",
-        ),
-        "Ratio précipitations / évapotranspiration en été (1994 - 2023)",
-        {
-            k: v.rainfall_sum / v.et0_fao_evapotranspiration
-            for k, v in average_summer_weather_per_department.items()
-        },
-        [
-            ("Très mauvais", "#E53935"),
-            ("Mauvais", "#FB8C00"),
-            ("Moyen", "#FDD835"),
-            ("Bon", "#C0CA33"),
-            ("Très bon", "#43A047"),
-        ],
-    )
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_temperature_ressentie_moyenne_ete.svg",
-        ),
+MAP_SPECS = (
+    MapSpec(
+        "carte_qualite_de_lair.svg",
+        "Indice moyen de qualité de l'air (2022 - 2024)",
+        "mean_air_quality",
+        QUALITY_CATEGORIES,
+    ),
+    MapSpec(
+        "carte_pics_de_pollution_de_lair.svg",
+        "Pics de pollution de l'air (2022 - 2024)",
+        "max_air_quality",
+        QUALITY_CATEGORIES,
+    ),
+    MapSpec(
+        "carte_ratio_precipitations_evapotranspiration.svg",
+        "Ratio précipitations / évapotranspiration en été (1994 - 2023)",
+        "summer_weather",
+        QUALITY_CATEGORIES[::-1],
+        rainfall_evapotranspiration_ratio,
+    ),
+    MapSpec(
+        "carte_temperature_ressentie_moyenne_ete.svg",
         "Température ressentie moyenne en été (1994 - 2023)",
-        {
-            k: v.apparent_temperature_mean
-            for k, v in average_summer_weather_per_department.items()
-        },
-        [
-            ("Le plus froid", "#FFCDD2"),  # 100
-            ("Plutôt froid", "#EF9A9A"),  # 200
-            ("Tempéré", "#EF5350"),  # 400
-            ("Plutôt chaud", "#E53935"),  # 600
-            ("Le plus chaud", "#C62828"),  # 800
-        ],
-    )
-
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_temperature_ressentie_moyenne_hiver.svg",
-        ),
+        "summer_weather",
+        HOT_TEMPERATURE_CATEGORIES,
+        attrgetter("apparent_temperature_mean"),
+    ),
+    MapSpec(
+        "carte_temperature_ressentie_moyenne_hiver.svg",
         "Température ressentie moyenne en hiver (1994 - 2023)",
-        {
-            k: v.apparent_temperature_mean
-            for k, v in average_winter_weather_per_department.items()
-        },
-        [
-            ("Le plus froid", "#1565C0"),  # 800
-            ("Plutôt froid", "#1E88E5"),  # 600
-            ("Tempéré", "#42A5F5"),  # 400
-            ("Plutôt chaud", "#90CAF9"),  # 200
-            ("Le plus chaud", "#BBDEFB"),  # 100
-        ],
-    )
-
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_temperature_ressentie_max_moyenne_ete.svg",
-        ),
+        "winter_weather",
+        COLD_TEMPERATURE_CATEGORIES,
+        attrgetter("apparent_temperature_mean"),
+    ),
+    MapSpec(
+        "carte_temperature_ressentie_max_moyenne_ete.svg",
         "Température ressentie maximale journalière moyenne en été (1994 - 2023)",
-        {
-            k: v.apparent_temperature_max
-            for k, v in average_summer_weather_per_department.items()
-        },
-        [
-            ("Le plus froid", "#FFCDD2"),  # 100
-            ("Plutôt froid", "#EF9A9A"),  # 200
-            ("Tempéré", "#EF5350"),  # 400
-            ("Plutôt chaud", "#E53935"),  # 600
-            ("Le plus chaud", "#C62828"),  # 800
-        ],
-    )
-
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_temperature_ressentie_min_moyenne_hiver.svg",
-        ),
+        "summer_weather",
+        HOT_TEMPERATURE_CATEGORIES,
+        attrgetter("apparent_temperature_max"),
+    ),
+    MapSpec(
+        "carte_temperature_ressentie_min_moyenne_hiver.svg",
         "Température ressentie minimale journalière moyenne en hiver (1994 - 2023)",
-        {
-            k: v.apparent_temperature_min
-            for k, v in average_winter_weather_per_department.items()
-        },
-        [
-            ("Le plus froid", "#1565C0"),  # 800
-            ("Plutôt froid", "#1E88E5"),  # 600
-            ("Tempéré", "#42A5F5"),  # 400
-            ("Plutôt chaud", "#90CAF9"),  # 200
-            ("Le plus chaud", "#BBDEFB"),  # 100
-        ],
-    )
-
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_irradiation_solaire_hiver.svg",
-        ),
+        "winter_weather",
+        COLD_TEMPERATURE_CATEGORIES,
+        attrgetter("apparent_temperature_min"),
+    ),
+    MapSpec(
+        "carte_irradiation_solaire_hiver.svg",
         "Irradiation solaire moyenne en MJ/m² en hiver (1994 - 2023)",
-        {
-            k: v.shortwave_radiation_sum
-            for k, v in average_winter_weather_per_department.items()
-        },
-        [
-            ("Très faible", "#FFF9C4"),  # 100
-            ("Faible", "#FFF59D"),  # 200
-            ("Moyen", "#FFEE58"),  # 400
-            ("Important", "#FDD835"),  # 600
-            ("Très important", "#F9A825"),  # 800
-        ],
-    )
-
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_irradiation_solaire_ete.svg",
-        ),
+        "winter_weather",
+        SUN_CATEGORIES,
+        attrgetter("shortwave_radiation_sum"),
+    ),
+    MapSpec(
+        "carte_irradiation_solaire_ete.svg",
         "Irradiation solaire moyenne en MJ/m² en été (1994 - 2023)",
-        {
-            k: v.shortwave_radiation_sum
-            for k, v in average_summer_weather_per_department.items()
-        },
-        [
-            ("Très faible", "#FFF9C4"),  # 100
-            ("Faible", "#FFF59D"),  # 200
-            ("Moyen", "#FFEE58"),  # 400
-            ("Important", "#FDD835"),  # 600
-            ("Très important", "#F9A825"),  # 800
-        ],
-    )
+        "summer_weather",
+        SUN_CATEGORIES,
+        attrgetter("shortwave_radiation_sum"),
+    ),
+    MapSpec(
+        "carte_ensolleillement_moyen_hiver.svg",
+        "Ensolleillement moyen en heures en hiver (1994 - 2023)",
+        "winter_weather",
+        SUN_CATEGORIES,
+        attrgetter("sunshine_duration"),
+    ),
+    MapSpec(
+        "carte_ensolleillement_moyen_ete.svg",
+        "Ensolleillement moyen en heures en été (1994 - 2023)",
+        "summer_weather",
+        SUN_CATEGORIES,
+        attrgetter("sunshine_duration"),
+    ),
+    MapSpec(
+        "carte_duree_moyenne_journee_hiver.svg",
+        "Durée moyenne d'une journée hivernale en heures (1994 - 2023)",
+        "winter_weather",
+        SUN_CATEGORIES,
+        attrgetter("daylight_duration"),
+    ),
+    MapSpec(
+        "carte_duree_moyenne_journee_ete.svg",
+        "Durée moyenne d'une journée estivale en heures (1994 - 2023)",
+        "summer_weather",
+        SUN_CATEGORIES,
+        attrgetter("daylight_duration"),
+    ),
+    MapSpec(
+        "carte_vitesse_du_vent_ete.svg",
+        "Vitesse moyenne du vent 10m au dessus du sol en km/h en été (1994 - 2023)",
+        "summer_weather",
+        WIND_CATEGORIES,
+        attrgetter("wind_speed_10m_max"),
+    ),
+    MapSpec(
+        "carte_vitesse_du_vent_hiver.svg",
+        "Vitesse moyenne du vent 10m au dessus du sol en km/h en hiver (1994 - 2023)",
+        "winter_weather",
+        WIND_CATEGORIES,
+        attrgetter("wind_speed_10m_max"),
+    ),
+    MapSpec(
+        "carte_heures_avec_pluie_hiver.svg",
+        "Nombre d'heures (en quantité, pas en durée) durant lesquelles il y a eu un moment de pluie en hiver (1994 - 2023)",
+        "winter_weather",
+        RAIN_CATEGORIES,
+        attrgetter("precipitation_hours"),
+    ),
+    MapSpec(
+        "carte_heures_avec_pluie_ete.svg",
+        "Nombre d'heures (en quantité, pas en durée) durant lesquelles il y a eu un moment de pluie en été (1994 - 2023)",
+        "summer_weather",
+        RAIN_CATEGORIES,
+        attrgetter("precipitation_hours"),
+    ),
+    MapSpec(
+        "carte_pluviometrie_hiver.svg",
+        "Pluviométrie moyenne sur toute la période hivernale en mm (1994 - 2023)",
+        "winter_weather",
+        RAIN_CATEGORIES,
+        attrgetter("rainfall_sum"),
+    ),
+    MapSpec(
+        "carte_pluviometrie_ete.svg",
+        "Pluviométrie moyenne sur toute la période estivale en mm (1994 - 2023)",
+        "summer_weather",
+        RAIN_CATEGORIES,
+        attrgetter("rainfall_sum"),
+    ),
+    MapSpec(
+        "carte_chutes_de_neige_hiver.svg",
+        "Chutes de neige moyennes sur toute la période hivernale en mm (1994 - 2023)",
+        "winter_weather",
+        SNOW_CATEGORIES,
+        attrgetter("snowfall_sum"),
+    ),
+    MapSpec(
+        "carte_pollution_des_sols.svg",
+        "Nombre d'incidents recensés dans la base BASOL ayants entrainé une pollution "
+        "des sols",
+        "soil_pollution_incidents_count",
+        RISK_CATEGORIES,
+    ),
+    MapSpec(
+        "carte_catastrophes_naturelles.svg",
+        "Nombre de catastrophes naturelles recensées dans la base GASPAR",
+        "natural_disasters_count",
+        RISK_CATEGORIES,
+    ),
+)
+
 
+def render_map(
+    arguments: tuple[Path, str, dict[str, Any], list[tuple[str, str]], bool, float],
+) -> None:
+    output_file, title, values, categories, shared_geometry, tolerance = arguments
     build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_ensolleillement_moyen_hiver.svg",
-        ),
-        "Ensolleillement moyen en heures en hiver (1994 - 2023)",
-        {
-            k: v.sunshine_duration
-            for k, v in average_winter_weather_per_department.items()
-        },
-        [
-            ("Très faible", "#FFF9C4"),  # 100
-            ("Faible", "#FFF59D"),  # 200
-            ("Moyen", "#FFEE58"),  # 400
-            ("Important", "#FDD835"),  # 600
-            ("Très important", "#F9A825"),  # 800
-        ],
+        output_file,
+        title,
+        values,
+        categories,
+        shared_geometry=shared_geometry,
+        simplification_tolerance=tolerance,
     )
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_ensolleillement_moyen_ete.svg",
-        ),
-        "Ensolleillement moyen en heures en été (1994 - 2023)",
-        {
-            k: v.sunshine_duration
-            for k, v in average_summer_weather_per_department.items()
-        },
-        [
-            ("Très faible", "#FFF9C4"),  # 100
-            ("Faible", "#FFF59D"),  # 200
-            ("Moyen", "#FFEE58"),  # 400
-            ("Important", "#FDD835"),  # 600
-            ("Très important", "#F9A825"),  # 800
+
+def render_maps(
+    specs: Iterable[MapSpec],
+    sources: dict[str, dict[str, Any]],
+    rendered_maps: RenderedMaps,
+    workers_count: int = 1,
+    shared_geometry: bool = True,
+    simplification_tolerance: float = MAP_SIMPLIFICATION_TOLERANCE,
+) -> None:
+    """Render the maps whose inputs changed since they were last rendered."""
+    arguments_per_map = {}
+    for spec in specs:
+        output_file = MAPS_DIRECTORY.joinpath(spec.filename)
+        values = {
+            department_code: spec.value(value) if spec.value else value
+            for department_code, value in sources[spec.source].items()
+        }
+        categories = list(spec.categories)
+        inputs = [
+            MAP_RENDERER_VERSION,
+            spec.filename,
+            spec.title,
+            categories,
+            values,
+            shared_geometry,
+            simplification_tolerance,
+        ]
+        inputs_hash = hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode(),
+        ).hexdigest()
+
+        geometry_is_missing = (
+            shared_geometry
+            and not MAPS_DIRECTORY.joinpath(SHARED_GEOMETRY_FILENAME).exists()
+        )
+        if not geometry_is_missing and rendered_maps.is_up_to_date(
+            output_file,
+            inputs_hash,
+        ):
+            print(f"{spec.filename} is up to date")
+            continue
+
+        arguments_per_map[output_file, inputs_hash] = (
+            output_file,
+            spec.title,
+            values,
+            categories,
+            shared_geometry,
+            simplification_tolerance,
+        )
+
+    if workers_count == 1:
+        for arguments in arguments_per_map.values():
+            render_map(arguments)
+    else:
+        # Each map builds its own pygal chart, which is CPU bound.
+        with ProcessPoolExecutor(max_workers=workers_count) as executor:
+            list(executor.map(render_map, arguments_per_map.values()))
+
+    for output_file, inputs_hash in arguments_per_map:
+        rendered_maps.put(output_file, inputs_hash)
+
+
+def encode_department_data(department_data: DepartmentData) -> dict[str, Any]:
+    cities = department_data.cities
+    return {
+        "cities": [asdict(city) for city in cities],
+        "average_season_weather": [
+            [asdict(w) for w in department_data.average_season_weather_per_city[city]]
+            for city in cities
         ],
-    )
+        "air_quality": [
+            asdict(department_data.air_quality_per_city[city]) for city in cities
+        ],
+    }
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_duree_moyenne_journee_hiver.svg",
-        ),
-        "Durée moyenne d'une journée hivernale en heures (1994 - 2023)",
+
+def decode_department_data(value: dict[str, Any]) -> DepartmentData:
+    cities = [City(**city) for city in value["cities"]]
+    return DepartmentData(
+        cities,
         {
-            k: v.daylight_duration
-            for k, v in average_winter_weather_per_department.items()
+            city: (Weather(**winter), Weather(**summer))
+            for city, (winter, summer) in zip(
+                cities,
+                value["average_season_weather"],
+                strict=True,
+            )
         },
-        [
-            ("Très faible", "#FFF9C4"),  # 100
-            ("Faible", "#FFF59D"),  # 200
-            ("Moyen", "#FFEE58"),  # 400
-            ("Important", "#FDD835"),  # 600
-            ("Très important", "#F9A825"),  # 800
-        ],
-    )
-
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_duree_moyenne_journee_ete.svg",
-        ),
-        "Durée moyenne d'une journée estivale en heures (1994 - 2023)",
         {
-            k: v.daylight_duration
-            for k, v in average_summer_weather_per_department.items()
+            city: AirQuality(**air_quality)
+            for city, air_quality in zip(cities, value["air_quality"], strict=True)
         },
-        [
-            ("Très faible", "#FFF9C4"),  # 100
-            ("Faible", "#FFF59D"),  # 200
-            ("Moyen", "#FFEE58"),  # 400
-            ("Important", "#FDD835"),  # 600
-            ("Très important", "#F9A825"),  # 800
-        ],
     )
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_vitesse_du_vent_ete.svg",
-        ),
-        "Vitesse moyenne du vent 10m au dessus du sol en km/h en été (1994 - 2023)",
-        {
-            k: v.wind_speed_10m_max
-            for k, v in average_summer_weather_per_department.items()
-        },
-        [
-            ("Très faible", "#B2DFDB"),  # 100
-            ("Faible", "#80CBC4"),  # 200
-            ("Moyen", "#26A69A"),  # 400
-            ("Important", "#00897B"),  # 600
-            ("Très important", "#00695C"),  # 800
-        ],
+
+WEIGHTINGS = ("equal", "population", "area")
+
+
+def compute_city_areas(
+    cities: list[City],
+    communes_json: list[dict[str, Any]],
+) -> list[float]:
+    """Share the surface of a department between its sampled cities.
+
+    Every commune is given to the nearest sampled city, which approximates
+    the Voronoi cells of the cities clipped to the department. Surfaces are
+    in hectares.
+    """
+    cities_coordinates = np.radians(
+        [[city.latitude, city.longitude] for city in cities],
+    )
+    # GeoJSON points are longitude first.
+    communes_coordinates = np.radians(
+        [commune["centre"]["coordinates"][::-1] for commune in communes_json],
+    ).reshape(-1, 2)
+    surfaces = np.array(
+        [commune["surface"] for commune in communes_json],
+        dtype=np.float64,
     )
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_vitesse_du_vent_hiver.svg",
-        ),
-        "Vitesse moyenne du vent 10m au dessus du sol en km/h en hiver (1994 - 2023)",
-        {
-            k: v.wind_speed_10m_max
-            for k, v in average_winter_weather_per_department.items()
-        },
-        [
-            ("Très faible", "#B2DFDB"),  # 100
-            ("Faible", "#80CBC4"),  # 200
-            ("Moyen", "#26A69A"),  # 400
-            ("Important", "#00897B"),  # 600
-            ("Très important", "#00695C"),  # 800
-        ],
+    # An equirectangular projection is accurate enough at the scale of a
+    # department to find the nearest city.
+    latitude_delta = communes_coordinates[:, None, 0] - cities_coordinates[None, :, 0]
+    longitude_delta = (
+        communes_coordinates[:, None, 1] - cities_coordinates[None, :, 1]
+    ) * np.cos(communes_coordinates[:, None, 0])
+    nearest_cities = np.argmin(latitude_delta**2 + longitude_delta**2, axis=1)
+    return np.bincount(nearest_cities, surfaces, minlength=len(cities)).tolist()
+
+
+def get_city_areas(
+    data_per_department: dict[str, DepartmentData],
+) -> dict[str, list[float]]:
+    return {
+        department_code: compute_city_areas(
+            department_data.cities,
+            get_department_communes(department_code),
+        )
+        for department_code, department_data in data_per_department.items()
+    }
+
+
+def get_city_weights(
+    data_per_department: dict[str, DepartmentData],
+    weighting: str,
+    areas_per_department: dict[str, list[float]] | None = None,
+) -> dict[str, list[float]]:
+    """Return the weight of every sampled city in its department's values."""
+    if weighting == "equal":
+        return {
+            department_code: [1.0] * len(department_data.cities)
+            for department_code, department_data in data_per_department.items()
+        }
+    if weighting == "population":
+        return {
+            department_code: [float(city.population) for city in department_data.cities]
+            for department_code, department_data in data_per_department.items()
+        }
+    if weighting == "area":
+        if areas_per_department is None:
+            error = "The area weighting needs the areas of the cities"
+            raise ValueError(error)
+        return areas_per_department
+
+    error = f"Unknown weighting '{weighting}'"
+    raise ValueError(error)
+
+
+def aggregate_per_department(
+    values_per_department: dict[str, Any],
+    weights_per_department: dict[str, list[float]],
+) -> dict[str, np.ndarray]:
+    """Compute the weighted means of the values of the cities of each department.
+
+    The values of a department are a (cities x variables) array. The values of
+    all the cities are stacked so that every department is reduced at once,
+    whatever the number of cities sampled per department.
+    """
+    department_codes = list(values_per_department)
+    values = [
+        np.asarray(values_per_department[code], dtype=np.float64)
+        for code in department_codes
+    ]
+    weights = [
+        np.asarray(weights_per_department[code], dtype=np.float64)
+        for code in department_codes
+    ]
+    for code, department_values, department_weights in zip(
+        department_codes,
+        values,
+        weights,
+        strict=True,
+    ):
+        if len(department_values) != len(department_weights):
+            error = (
+                f"{len(department_weights)} weights were given "
+                f"for the {len(department_values)} cities of {code}"
+            )
+            raise CityError(error)
+        if department_weights.sum() <= 0:
+            error = f"The cities of {code} have no weight"
+            raise CityError(error)
+
+    means = average(
+        np.concatenate(values),
+        weights=np.concatenate(weights),
+        groups=np.repeat(np.arange(len(weights)), [len(w) for w in weights]),
+        groups_count=len(weights),
     )
+    return dict(zip(department_codes, means, strict=True))
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_heures_avec_pluie_hiver.svg",
-        ),
-        "Nombre d'heures (en quantité, pas en durée) durant lesquelles il y a eu un moment de pluie en hiver (1994 - 2023)",
+
+def compute_weather_per_department(
+    data_per_department: dict[str, DepartmentData],
+    season: int,
+    weights_per_department: dict[str, list[float]],
+) -> dict[str, Weather]:
+    """Average the weather of the cities of each department during a season."""
+    means = aggregate_per_department(
         {
-            k: v.precipitation_hours
-            for k, v in average_winter_weather_per_department.items()
+            department_code: [
+                [
+                    getattr(
+                        department_data.average_season_weather_per_city[city][season],
+                        field,
+                    )
+                    for field in WEATHER_FIELDS
+                ]
+                for city in department_data.cities
+            ]
+            for department_code, department_data in data_per_department.items()
         },
-        [
-            ("Très faible", "#BBDEFB"),  # 100
-            ("Faible", "#90CAF9"),  # 200
-            ("Moyenne", "#42A5F5"),  # 400
-            ("Importante", "#1E88E5"),  # 600
-            ("Très importante", "#1565C0"),  # 800
-        ],
+        weights_per_department,
     )
+    return {
+        department_code: Weather(*mean.tolist())
+        for department_code, mean in means.items()
+    }
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_heures_avec_pluie_ete.svg",
-        ),
-        "Nombre d'heures (en quantité, pas en durée) durant lesquelles il y a eu un moment de pluie en été (1994 - 2023)",
+
+def compute_air_quality_per_department(
+    data_per_department: dict[str, DepartmentData],
+    field: str,
+    weights_per_department: dict[str, list[float]],
+) -> dict[str, float]:
+    """Average an air quality field of the cities of each department."""
+    means = aggregate_per_department(
         {
-            k: v.precipitation_hours
-            for k, v in average_summer_weather_per_department.items()
+            department_code: [
+                [getattr(department_data.air_quality_per_city[city], field)]
+                for city in department_data.cities
+            ]
+            for department_code, department_data in data_per_department.items()
         },
-        [
-            ("Très faible", "#BBDEFB"),  # 100
-            ("Faible", "#90CAF9"),  # 200
-            ("Moyenne", "#42A5F5"),  # 400
-            ("Importante", "#1E88E5"),  # 600
-            ("Très importante", "#1565C0"),  # 800
-        ],
+        weights_per_department,
     )
+    return {department_code: float(mean[0]) for department_code, mean in means.items()}
+
+
+def get_stages(
+    store: ResultStore,
+    checkpoints: Checkpoints,
+    geocoding: str,
+    workers_count: int,
+    specs: list[MapSpec],
+    shared_geometry: bool,
+    simplification_tolerance: float,
+    weighting: str = "equal",
+    sampling: str = "cities",
+    grid_resolution: float = GRID_RESOLUTION,
+) -> list[Stage]:
+    """Return the stages generating the maps of the given specs."""
+
+    def encode_weather_per_department(values: dict[str, Weather]) -> dict[str, Any]:
+        return {code: asdict(weather) for code, weather in values.items()}
+
+    def decode_weather_per_department(values: dict[str, Any]) -> dict[str, Weather]:
+        return {code: Weather(**weather) for code, weather in values.items()}
+
+    def encode_data_per_department(
+        values: dict[str, DepartmentData],
+    ) -> dict[str, Any]:
+        return {code: encode_department_data(data) for code, data in values.items()}
+
+    def decode_data_per_department(
+        values: dict[str, Any],
+    ) -> dict[str, DepartmentData]:
+        return {code: decode_department_data(data) for code, data in values.items()}
+
+    def render(*sources: dict[str, Any]) -> None:
+        render_maps(
+            specs,
+            dict(zip(sources_names, sources, strict=True)),
+            RenderedMaps(RESULT_STORE_PATH),
+            workers_count,
+            shared_geometry=shared_geometry,
+            simplification_tolerance=simplification_tolerance,
+        )
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_pluviometrie_hiver.svg",
+    sources_names = tuple(dict.fromkeys(spec.source for spec in specs))
+    # The departments are either sampled cities or the cells of a grid.
+    departments_stages = [
+        Stage(
+            "departments",
+            lambda: process_departments(store, checkpoints, geocoding, workers_count),
+            # The number of workers doesn't change the result.
+            parameters={
+                "geocoding": geocoding,
+                "datasets": [WEATHER_DATASET, AIR_QUALITY_DATASET],
+            },
+            encode=encode_data_per_department,
+            decode=decode_data_per_department,
         ),
-        "Pluviométrie moyenne sur toute la période hivernale en mm (1994 - 2023)",
-        {k: v.rainfall_sum for k, v in average_winter_weather_per_department.items()},
-        [
-            ("Très faible", "#BBDEFB"),  # 100
-            ("Faible", "#90CAF9"),  # 200
-            ("Moyenne", "#42A5F5"),  # 400
-            ("Importante", "#1E88E5"),  # 600
-            ("Très importante", "#1565C0"),  # 800
-        ],
-    )
+    ]
+    if sampling == "grid":
+        departments_stages = [
+            Stage(
+                "commune_grid",
+                lambda: CommuneGrid.build(grid_resolution),
+                parameters={"resolution": grid_resolution},
+                encode=CommuneGrid.to_json,
+                decode=CommuneGrid.from_json,
+            ),
+            Stage(
+                "departments",
+                lambda grid: process_departments_gridded(store, grid, workers_count),
+                ("commune_grid",),
+                parameters={"datasets": [WEATHER_DATASET, AIR_QUALITY_DATASET]},
+                encode=encode_data_per_department,
+                decode=decode_data_per_department,
+            ),
+        ]
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_pluviometrie_ete.svg",
+    # Only the area weighting needs the communes of every department.
+    weights_dependencies = ("departments",)
+    area_stages = []
+    if weighting == "area":
+        weights_dependencies += ("city_areas",)
+        area_stages.append(Stage("city_areas", get_city_areas, ("departments",)))
+    outputs = [MAPS_DIRECTORY.joinpath(spec.filename) for spec in specs]
+    if shared_geometry:
+        outputs.append(MAPS_DIRECTORY.joinpath(SHARED_GEOMETRY_FILENAME))
+
+    return [
+        *departments_stages,
+        *area_stages,
+        Stage(
+            "city_weights",
+            lambda *values: get_city_weights(values[0], weighting, *values[1:]),
+            weights_dependencies,
+            parameters={"weighting": weighting},
         ),
-        "Pluviométrie moyenne sur toute la période estivale en mm (1994 - 2023)",
-        {k: v.rainfall_sum for k, v in average_summer_weather_per_department.items()},
-        [
-            ("Très faible", "#BBDEFB"),  # 100
-            ("Faible", "#90CAF9"),  # 200
-            ("Moyenne", "#42A5F5"),  # 400
-            ("Importante", "#1E88E5"),  # 600
-            ("Très importante", "#1565C0"),  # 800
-        ],
-    )
-
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_chutes_de_neige_hiver.svg",
+        Stage(
+            "winter_weather",
+            lambda data, weights: compute_weather_per_department(data, WINTER, weights),
+            ("departments", "city_weights"),
+            encode=encode_weather_per_department,
+            decode=decode_weather_per_department,
         ),
-        "Chutes de neige moyennes sur toute la période hivernale en mm (1994 - 2023)",
-        {k: v.snowfall_sum for k, v in average_winter_weather_per_department.items()},
-        [
-            ("Très faibles", "#B2EBF2"),  # 100
-            ("Faibles", "#80DEEA"),  # 200
-            ("Moyennes", "#26C6DA"),  # 400
-            ("Importantes", "#00ACC1"),  # 600
-            ("Très importantes", "#00838F"),  # 800
-        ],
-    )
+        Stage(
+            "summer_weather",
+            lambda data, weights: compute_weather_per_department(data, SUMMER, weights),
+            ("departments", "city_weights"),
+            encode=encode_weather_per_department,
+            decode=decode_weather_per_department,
+        ),
+        Stage(
+            "mean_air_quality",
+            lambda data, weights: compute_air_quality_per_department(
+                data,
+                "european_aqi_mean",
+                weights,
+            ),
+            ("departments", "city_weights"),
+        ),
+        Stage(
+            "max_air_quality",
+            lambda data, weights: compute_air_quality_per_department(
+                data,
+                "european_aqi_max",
+                weights,
+            ),
+            ("departments", "city_weights"),
+        ),
+        # The databases are downloaded again only if they have been updated.
+        Stage(
+            "soil_pollution_incidents_count",
+            get_soil_pollution_incidents_count,
+            always_run=True,
+        ),
+        Stage(
+            "natural_disasters_count",
+            get_referenced_natural_disaster_count,
+            always_run=True,
+        ),
+        Stage(
+            "maps",
+            render,
+            sources_names,
+            parameters={
+                "version": MAP_RENDERER_VERSION,
+                "specs": [
+                    [spec.filename, spec.title, spec.source, spec.categories]
+                    for spec in specs
+                ],
+                "shared_geometry": shared_geometry,
+                "simplification_tolerance": simplification_tolerance,
+            },
+            outputs=tuple(outputs),
+        ),
+    ]
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath("../_static/images/carte_pollution_des_sols.svg"),
-        "Nombre d'incidents recensés dans la base BASOL ayants entrainé une pollution "
-        "des sols",
-        soil_pollution_incidents_count_per_department,
-        [
-            ("Très faible", "#43A047"),
-            ("Faible", "#C0CA33"),
-            ("Moyen", "#FDD835"),
-            ("Important", "#FB8C00"),
-            ("Très important", "#E53935"),
-        ],
-    )
 
-    build_plot(
-        THIS_SCRIPT_LOCATION.joinpath(
-            "../_static/images/carte_catastrophes_naturelles.svg",
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Generate the maps of the 'choix de la région' page.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the last run from where it stopped",
+    )
+    parser.add_argument(
+        "--geocoding",
+        choices=["gazetteer", "api"],
+        default="gazetteer",
+        help="find cities with the GeoNames dumps or the Open-Meteo geocoding API",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="how many departments, then maps, are processed in parallel",
+    )
+    parser.add_argument(
+        "--geometry",
+        choices=["shared", "inline"],
+        default="shared",
+        help="share the department paths between maps or embed them in every map",
+    )
+    parser.add_argument(
+        "--simplification-tolerance",
+        type=float,
+        default=MAP_SIMPLIFICATION_TOLERANCE,
+        metavar="PIXELS",
+        help="how far simplified department paths can be from the original ones "
+        "(0 keeps the paths as rendered by pygal)",
+    )
+    parser.add_argument(
+        "--sampling",
+        choices=["cities", "grid"],
+        default="cities",
+        help="sample a few cities per department, or cover all the communes "
+        "with the cells of a regular latitude/longitude grid",
+    )
+    parser.add_argument(
+        "--grid-resolution",
+        type=float,
+        default=GRID_RESOLUTION,
+        metavar="DEGREES",
+        help="size of the cells of the grid, with --sampling grid",
+    )
+    parser.add_argument(
+        "--weighting",
+        choices=WEIGHTINGS,
+        default="equal",
+        help="how much each sampled city counts in the values of its department: "
+        "the same, its population, or the area of the communes nearest to it",
+    )
+    parser.add_argument(
+        "maps",
+        nargs="*",
+        metavar="map",
+        help="which maps to generate, by file name (default: all)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="list the stages that would run, without running them",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="append",
+        default=[],
+        metavar="STAGE",
+        help="run the given stage even if its inputs didn't change, for instance "
+        "to render the maps again",
+    )
+    args = parser.parse_args()
+
+    specs_per_filename = {spec.filename: spec for spec in MAP_SPECS}
+    for filename in args.maps:
+        if filename not in specs_per_filename:
+            parser.error(f"unknown map '{filename}'")
+    specs = [specs_per_filename[filename] for filename in args.maps] or list(MAP_SPECS)
+
+    store = ResultStore(RESULT_STORE_PATH)
+    checkpoints = Checkpoints(RESULT_STORE_PATH, resume=args.resume)
+    build_graph = BuildGraph(
+        RESULT_STORE_PATH,
+        get_stages(
+            store,
+            checkpoints,
+            args.geocoding,
+            args.workers,
+            specs,
+            shared_geometry=args.geometry == "shared",
+            simplification_tolerance=args.simplification_tolerance,
+            weighting=args.weighting,
+            sampling=args.sampling,
+            grid_resolution=args.grid_resolution,
         ),
-        "Nombre de catastrophes naturelles recensées dans la base GASPAR",
-        natural_disasters_count_per_department,
-        [
-            ("Très faible", "#43A047"),
-            ("Faible", "#C0CA33"),
-            ("Moyen", "#FDD835"),
-            ("Important", "#FB8C00"),
-            ("Très important", "#E53935"),
-        ],
     )
 
+    for name in args.rebuild:
+        if name not in build_graph.stages:
+            parser.error(f"unknown stage '{name}'")
+
+    if args.dry_run:
+        stale_stages = build_graph.stale_stages(["maps"], args.rebuild)
+        for name in stale_stages:
+            print(name)
+        if not stale_stages:
+            print("Everything is up to date")
+        revalidated_stages = [
+            name
+            for name in build_graph.order(["maps"])
+            if build_graph.stages[name].always_run and name not in stale_stages
+        ]
+        if revalidated_stages:
+            print(
+                "Checked for updates, the stages depending on them only run "
+                f"if they changed: {', '.join(revalidated_stages)}",
+            )
+        return
+
+    build_graph.build(["maps"], args.rebuild)
+
 
 if __name__ == "__main__":
     main()